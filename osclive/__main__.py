@@ -1,10 +1,13 @@
 #!/usr/bin/python3
 import time
+import signal
 import argparse
+import functools
 
 from . import studiolive
-from .osc import SharedTCPServer, zc_register_osc_tcp
+from .osc import SharedTCPServer, AsyncTCPServer, UDPServer, MulticastSender, zc_register_osc_tcp, zc_register_osc_udp
 from .handler import SLClientHandler
+from .metrics import MetricsServer
 
 
 def main() -> None:
@@ -13,6 +16,19 @@ def main() -> None:
     argp.add_argument("-c", "--config", help="Load YAML configuration file", metavar='CFG')
     argp.add_argument("-d", "--debug", help="Print debug informations", action='store_true')
     argp.add_argument("-m", "--midi", help="Use midi port instead of IEEE1394")
+    argp.add_argument("-w", "--write-window", help="Coalesce control writes to the mixer within this time window (default 20 ms)", metavar='MS', type=float, default=20)
+    argp.add_argument("-r", "--poll-rate", help="Mixer status poll rate with meters in use or controls moving (default 30 Hz)", metavar='HZ', type=float, default=30)
+    argp.add_argument("--idle-poll-rate", help="Mixer status poll rate with no client connected (default 2 Hz)", metavar='HZ', type=float, default=2)
+    argp.add_argument("-e", "--emulate", help="Use a software emulated mixer instead of the hardware", action='store_true')
+    argp.add_argument("--emulate-latency", help="Emulated mixer transaction latency (default 1 ms)", metavar='MS', type=float, default=1)
+    argp.add_argument("--fader-storm", help="Emulated console fader moves per second (default 0)", metavar='HZ', type=float, default=0)
+    argp.add_argument("-a", "--asyncio", help="Serve all OSC clients from a single asyncio event loop", action='store_true')
+    argp.add_argument("--udp", help="Serve OSC over UDP too (same port as TCP)", action='store_true')
+    argp.add_argument("--udp-timeout", help="Drop UDP clients silent for this time (default never, clients must send keepalives)", metavar='SECS', type=float)
+    argp.add_argument("--multicast", help="Offer meters on multicast group (default port 4302)", metavar='GROUP[:PORT]')
+    argp.add_argument("--metrics", help="Serve metrics over HTTP (default address 127.0.0.1)", metavar='[ADDR:]PORT')
+    argp.add_argument("--trace", help="Trace mixer frames and control events, dump to FILE on SIGUSR1 or /trace/dump", metavar='FILE')
+    argp.add_argument("--trace-size", help="Number of trace records kept (default 4096)", metavar='N', type=int, default=4096)
     args = argp.parse_args()
 
     slbackend: studiolive.SLBackend
@@ -21,9 +37,19 @@ def main() -> None:
         slbackend = SLUcBackend(studiolive.StudioLive1602.uc, args.uc)
     else:
         from .studiolive.rawbackend import SLRawBackend
-        slbackend = SLRawBackend(studiolive.StudioLive1602.raw, args.midi)
+        adapter = None
+        if args.emulate:
+            from .studiolive.emulator import EmulatorAdapter
+            adapter = functools.partial(EmulatorAdapter, studiolive.StudioLive1602.raw,
+                                        latency=args.emulate_latency / 1000, storm=args.fader_storm)
+        slbackend = SLRawBackend(studiolive.StudioLive1602.raw, args.midi, write_window=args.write_window / 1000,
+                                 poll_rate=args.poll_rate, idle_poll_rate=args.idle_poll_rate, adapter=adapter)
 
     slbackend.debug = args.debug
+    if args.trace:
+        from .studiolive.trace import TraceBuffer
+        trace = slbackend.trace = TraceBuffer(args.trace_size, path=args.trace)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: trace.dump())
     sl = studiolive.SLRemote(slbackend, args.debug)
     sl.debug = args.debug
     sl.connect()
@@ -39,15 +65,43 @@ def main() -> None:
                 SLClientHandler.input_names = cfg_sl["input"]["names"]
             if cfg_sl.get("aux") and cfg_sl.get("aux").get("names"):
                 SLClientHandler.aux_names = cfg_sl["aux"]["names"]
+        if cfg.get("meters"):
+            cfg_meters = cfg.get("meters")
+            SLClientHandler.meter_deadband = cfg_meters.get("deadband", SLClientHandler.meter_deadband)
+            SLClientHandler.meter_keyframe = cfg_meters.get("keyframe", SLClientHandler.meter_keyframe)
 
-    osc_srv = SharedTCPServer(SLClientHandler)
-    zc_svcs = zc_register_osc_tcp()
+    zc_props = {}
+    if args.multicast:
+        group, _, port = args.multicast.partition(":")
+        SLClientHandler.meter_multicast = MulticastSender(group, int(port) if port else 4302)
+        zc_props["meters"] = "%s:%d" % SLClientHandler.meter_multicast.address
+
+    osc_srv: SharedTCPServer | AsyncTCPServer
+    if args.asyncio:
+        osc_srv = AsyncTCPServer(SLClientHandler)
+    else:
+        osc_srv = SharedTCPServer(SLClientHandler)
+    zc_svcs = zc_register_osc_tcp(properties=zc_props)
+
+    udp_srv = None
+    if args.udp:
+        udp_srv = UDPServer(SLClientHandler, client_timeout=args.udp_timeout)
+        zc_svcs += zc_register_osc_udp(properties=zc_props)
+
+    metrics_srv = None
+    if args.metrics:
+        addr, _, port = args.metrics.rpartition(":")
+        metrics_srv = MetricsServer(int(port), addr or "127.0.0.1")
 
     try:
         while True:
             time.sleep(0.1)
     finally:
         osc_srv.shutdown()
+        if udp_srv:
+            udp_srv.shutdown()
+        if metrics_srv:
+            metrics_srv.shutdown()
         for zc, si in zc_svcs:
             zc.close()
         sl.disconnect()
@@ -1,10 +1,33 @@
+import functools
 import re
+import threading
+import time
 
-from typing import Any
+from dataclasses import dataclass, field
+from typing import Any, ContextManager, Optional
 
+from .metrics import registry
 from .studiolive import SLRemote
 
-from .osc.server import DispatchedOSCRequestHandler, OscValue
+from .osc.server import DispatchedOSCRequestHandler, DispatchTable, OscValue, message_cache, encode_message, encode_bundle, encode_bundles
+from .osc.server import compile_pattern, encode_blob_message, MulticastSender
+
+
+@dataclass
+class SLClientLayout:
+    "Channel lists and OSC dispatch table, built once per SLRemote and shared by all clients"
+    inputs: list[str]
+    auxs: list[str]
+    fxs: list[str]
+    channel_ctrls: list[str]
+    geq_freqs: list[str]
+    all_channels: list[str] = field(init=False)
+    level_addrs: dict[str, str] = field(init=False)
+    dispatcher: DispatchTable = field(default_factory=DispatchTable)
+
+    def __post_init__(self) -> None:
+        self.all_channels = self.inputs + self.auxs + self.fxs + ["main"]
+        self.level_addrs = {ch: "/channel/%s/level" % ch for ch in self.inputs}
 
 
 class SLClientHandler(DispatchedOSCRequestHandler):
@@ -14,117 +37,355 @@ class SLClientHandler(DispatchedOSCRequestHandler):
     input_names: dict[str, str] = {}
     aux_names: dict[str, str] = {}
 
+    # Meters: only levels moved by more than deadband (0 = any change) are sent, all of them every keyframe seconds
+    meter_deadband = 0
+    meter_keyframe = 2.0
+
+    # Optional multicast group for meters, one datagram per tick serves all clients using it
+    meter_multicast: Optional[MulticastSender] = None
+
+    # /connection_ping toggles every ping_interval seconds, sent to all clients with or without meters
+    ping_interval = 0.8
+    _ping_clients: list["SLClientHandler"] = []
+    _ping_lock = threading.Lock()
+    _ping_thread: Optional[threading.Thread] = None
+
+    _layouts: dict[SLRemote, SLClientLayout] = {}
+
+    @classmethod
+    def get_layout(cls, sl: SLRemote) -> SLClientLayout:
+        layout = cls._layouts.get(sl)
+        if layout is None:
+            channels = sl.channels
+            layout = SLClientLayout(
+                inputs=[n for n in channels if re.match("^ch", n)],
+                auxs=[n for n in channels if re.match("^aux", n)],
+                fxs=[n for n in channels if re.match("^fx[a-z]", n)],
+                channel_ctrls=list(channels["ch1"].ctrls),
+                geq_freqs=[n for n in channels["geq0"].ctrls if re.match(".*Hz$", n)] if "geq0" in channels else [],
+            )
+            cls.init_dispatcher(sl, layout)
+            cls._layouts[sl] = layout
+        return layout
+
+    def get_dispatcher(self) -> DispatchTable:
+        return self.get_layout(self.sl).dispatcher
+
+    def dispatch_group(self) -> ContextManager[Any]:
+        # Writes matched by one address pattern are written once per channel
+        return self.sl.batch()
+
     def setup(self) -> None:
         super().setup()
 
-        channels = self.sl.channels
-        self.channel_ctrls = channels["ch1"].ctrls
-
-        self.inputs = [n for n in channels if re.match("^ch", n)]
-        self.auxs = [n for n in channels if re.match("^aux", n)]
-        self.fxs = [n for n in channels if re.match("^fx[a-z]", n)]
-        self.all_channels = self.inputs + self.auxs + self.fxs + ["main"]
+        layout = self.get_layout(self.sl)
+        self.channel_ctrls = layout.channel_ctrls
+        self.inputs = layout.inputs
+        self.auxs = layout.auxs
+        self.fxs = layout.fxs
+        self.all_channels = layout.all_channels
+        self.level_addrs = layout.level_addrs
+        self.geq_freqs = layout.geq_freqs
 
-        self.peaks: dict[str, float] = {ch: 0 for ch in self.all_channels}
+        self.peaks: dict[str, int] = {ch: 0 for ch in self.all_channels}
 
-        self.connection_ping = 0
+        self.connection_ping = False
+        self.ping_start()
 
         self.sl.add_update_callback(self.sl_control_handler)
-        self.sl.level_callbacks.append(self.sl_level_handler)
 
-        self.init_dispatcher()
+        # Clients are subscribed to all input meters at full rate until they ask otherwise
+        self.meters_subscribed = False
+        self.meter_format = "address"
+        self.meter_multicast_enabled = False
+        self.meters_subscribe(0, None)
+        self.meters_deadband(self.meter_deadband, self.meter_keyframe)
+
         self.init()
 
     def finish(self) -> None:
         self.sl.remove_update_callback(self.sl_control_handler)
-        self.sl.level_callbacks.remove(self.sl_level_handler)
+        self.meters_unsubscribe()
+        self.ping_stop()
 
         super().finish()
 
-    def _get_freqs(self, ch: str) -> list[str]:
-        return [n for n in self.sl.channels[ch].ctrls if re.match(".*Hz$", n)]
-
-    def init_dispatcher(self) -> None:
-        for channel in self.all_channels:
-            for control in self.channel_ctrls:
-                self.map(f"/channel/{channel}/{control}", self.channel_control_handler, channel, control)
+    def meters_subscribe(self, fps: float, pattern: Optional[str]) -> None:
+        "Send meters of input channels matching the pattern, at most fps times per second (0 = every update)"
+        regex = compile_pattern(pattern) if pattern else None
+        self.meter_channels = [ch for ch in self.inputs if regex is None or regex.fullmatch(ch)]
+        self.meter_interval = 1 / fps if fps > 0 else 0
+        self._meter_next = 0.0
+        self._meter_keyframe_next = 0.0
+        self._meter_sent: dict[str, int] = {}
+        # Clients with the same channel selection share the encoded meter bundle
+        self._meter_key = ("levels", tuple(self.meter_channels))
+        self._meter_build = functools.partial(self._encode_levels, self.meter_channels)
+
+        if not self.meters_subscribed:
+            self.meters_subscribed = True
+            self.sl.level_callbacks.append(self.sl_level_handler)
+
+    def meters_deadband(self, deadband: int, keyframe: float) -> None:
+        "Send only meter changes larger than deadband, full meters each keyframe seconds (0 = always)"
+        self.meter_deadband = deadband
+        self.meter_keyframe = keyframe
+        self._meter_keyframe_next = 0.0
+
+    def meters_format(self, fmt: str) -> None:
+        """Meter message format
+
+        address: /channel/<ch>/level and /channel/<ch>/peak messages (default)
+        blob: single /meters message, blob of uint8 levels of subscribed channels followed by their peaks
+        """
+        assert fmt in ["address", "blob"], "Unknown meter format %s" % fmt
+        self.meter_format = fmt
+        self._meter_keyframe_next = 0.0
+
+    def meters_multicast(self, enable: bool) -> None:
+        """Receive meters from the multicast group instead of this connection
+
+        The group gets levels of all input channels in the address format, peaks are still sent to the client.
+        """
+        self.meter_multicast_enabled = enable and self.meter_multicast is not None
+        self._meter_keyframe_next = 0.0
+
+    def meters_unsubscribe(self) -> None:
+        # Without any level callback the backend knows meters are unused
+        if self.meters_subscribed:
+            self.meters_subscribed = False
+            self.sl.level_callbacks.remove(self.sl_level_handler)
+
+    @classmethod
+    def init_dispatcher(cls, sl: SLRemote, layout: SLClientLayout) -> None:
+        d = layout.dispatcher
+        for channel in layout.all_channels:
+            for control in layout.channel_ctrls:
+                d.map(f"/channel/{channel}/{control}", cls.channel_control_handler, channel, control)
 
             for control in ["panreset", "peak_reset"]:
-                self.map(f"/channel/{channel}/{control}", self.channel_control_extra_handler, channel, control)
+                d.map(f"/channel/{channel}/{control}", cls.channel_control_extra_handler, channel, control)
 
         ch = "geq0"
-        if ch in self.sl.channels:
-            freqs = self._get_freqs(ch)
+        if ch in sl.channels:
+            freqs = layout.geq_freqs
             for i in range(len(freqs)):
-                self.map("/channel/%s/%d" % (ch, i + 1), self.channel_control_handler, ch, freqs[i])
+                d.map("/channel/%s/%d" % (ch, i + 1), cls.channel_control_handler, ch, freqs[i])
             for ctrl in ["enable"]:
-                self.map("/channel/%s/%s" % (ch, ctrl), self.channel_control_handler, ch, ctrl)
+                d.map("/channel/%s/%s" % (ch, ctrl), cls.channel_control_handler, ch, ctrl)
             for ctrl in ["reset"]:
-                self.map("/channel/%s/%s" % (ch, ctrl), self.channel_control_extra_handler, ch, ctrl)
+                d.map("/channel/%s/%s" % (ch, ctrl), cls.channel_control_extra_handler, ch, ctrl)
         # TODO
         #for i in ["fx0"]:
         #    for ctrl in ["param%d"%i for i in range(6)]:
-        #        self.map("/fx/%s"%(ctrl), self.common_channel_handler, i, ctrl)
-
-        self.map("/init", self._init)
+        #        d.map("/fx/%s"%(ctrl), cls.common_channel_handler, i, ctrl)
+
+        d.map("/init", cls._init)
+        d.map("/meters/subscribe", cls._meters_subscribe)
+        d.map("/meters/unsubscribe", cls._meters_unsubscribe)
+        d.map("/meters/deadband", cls._meters_deadband)
+        d.map("/meters/format", cls._meters_format)
+        d.map("/meters/multicast", cls._meters_multicast)
+        d.map("/stats", cls._stats)
+        d.map("/trace/dump", cls._trace_dump)
+
+    def _meters_subscribe(self, addr: str, fps: float = 0, pattern: Optional[str] = None) -> None:
+        self.meters_subscribe(fps, pattern)
+
+    def _meters_unsubscribe(self, addr: str, *args: Any) -> None:
+        self.meters_unsubscribe()
+
+    def _meters_deadband(self, addr: str, deadband: int, keyframe: Optional[float] = None) -> None:
+        self.meters_deadband(int(deadband), self.meter_keyframe if keyframe is None else keyframe)
+
+    def _meters_format(self, addr: str, fmt: str) -> None:
+        self.meters_format(fmt)
+
+    def _meters_multicast(self, addr: str, enable: bool = True) -> None:
+        self.meters_multicast(bool(enable))
+
+    def _stats(self, addr: str, pattern: Optional[str] = None) -> None:
+        self.send_stats(pattern)
+
+    def send_stats(self, pattern: Optional[str] = None) -> None:
+        """Send metrics with names matching the pattern as /stats/<name>[/<label values>] messages
+
+        Counters and gauges have one value, histograms have count, sum, p50 and p99 (seconds).
+        """
+        regex = compile_pattern(pattern) if pattern else None
+        msgs = []
+        for name, labels, values in registry.summary():
+            if regex is None or regex.fullmatch(name):
+                address = "/".join(["/stats", name] + [v for k, v in labels])
+                value: OscValue = list(values) if len(values) > 1 else values[0]
+                msgs.append(encode_message(address, value))
+        for packet in encode_bundles(msgs, self.max_bundle_size):
+            self.send_encoded(packet)
+
+    def _trace_dump(self, addr: str, *args: Any) -> None:
+        "Write the backend trace to its file, reply with the file name (empty without trace)"
+        trace = self.sl.backend.trace
+        self.send_message("/trace/dump", trace.dump() if trace else "")
 
     def _init(self, addr: str) -> None:
+        self.sync_start = time.monotonic()
         self.init()
 
-    def init(self) -> None:
-        all_channels = self.inputs + self.auxs + self.fxs + ["main"]
-        for ch in all_channels:
+    def _encode_init(self) -> list[bytes]:
+        channels = self.sl.snapshot()
+        msgs = []
+        for ch in self.all_channels:
             for ctrl in self.channel_ctrls:
-                value = self.sl.get_control(ch, ctrl)
-                if value is None:
-                    self.send_message("/channel/%s/%s" % (ch, ctrl), 0)
-                else:
-                    self.send_message("/channel/%s/%s" % (ch, ctrl), value)
+                value = channels[ch].ctrls[ctrl]
+                msgs.append(encode_message("/channel/%s/%s" % (ch, ctrl), 0 if value is None else value))
 
         # Update labels
-        for i, (ch, name) in enumerate(self.input_names.items(), 1):
-            self.send_message("/channel/%s/label" % ch, name)
-
-        for i, (ch, name) in enumerate(self.aux_names.items(), 1):
-            self.send_message("/channel/%s/label" % ch , name)
-        self.send_message("/channel/main/label", 'Main')
+        for ch, name in self.input_names.items():
+            msgs.append(encode_message("/channel/%s/label" % ch, name))
+        for ch, name in self.aux_names.items():
+            msgs.append(encode_message("/channel/%s/label" % ch, name))
+        msgs.append(encode_message("/channel/main/label", 'Main'))
 
         ch = "geq0"
-        if ch in self.sl.channels:
-            f = list(self.sl.channels[ch].ctrls.keys())
+        if ch in channels:
+            f = list(channels[ch].ctrls.keys())
             index = f.index("20Hz")
             for i in range(index, index + 31):
-                value = self.sl.get_control(ch, f[i])
-                self.send_message("/channel/%s/%d" % (ch, i - index + 1), value)
+                msgs.append(encode_message("/channel/%s/%d" % (ch, i - index + 1), channels[ch].ctrls[f[i]]))
             for ctrl in ["enable"]:
-                value = self.sl.get_control(ch, ctrl)
-                self.send_message("/channel/%s/%s" % (ch, ctrl), value)
+                msgs.append(encode_message("/channel/%s/%s" % (ch, ctrl), channels[ch].ctrls[ctrl]))
+
+        return encode_bundles(msgs, self.max_bundle_size)
+
+    def init(self) -> None:
+        # Snapshot is encoded once per state version and shared by clients connecting meanwhile
+        self.send_snapshot(self.osc_server.shared.get("init", self.sl.state_seq, self._encode_init))
+
+    def _encode_levels(self, channels: list[str]) -> tuple[bytes, dict[str, int]]:
+        levels = {}
+        for ch in channels:
+            v = self.sl.get_level(ch)
+            value: float
+            if v is None:
+                value = 0
+            elif isinstance(v, tuple):
+                value = v[0]
+            else:
+                value = v
+            levels[ch] = int(value / 32.0 * 16)
+        return encode_bundle([message_cache.get(self.level_addrs[ch], v) for ch, v in levels.items()]), levels
 
     def sl_level_handler(self) -> None:
-        with self.bundle():
-            self.connection_ping += 1
-            if self.connection_ping >= 16:
-                self.connection_ping = 0
-
-            if self.connection_ping % 8 == 0:
-                self.send_message("/connection_ping", self.connection_ping >= 8)
-
-            for ch in self.inputs:
-                v = self.sl.get_level(ch)
-                value: float
-                if v is None:
-                    value = 0
-                elif isinstance(v, tuple):
-                    value = v[0]
-                else:
-                    value = v
-                value /= 32.0
-
-                if value > self.peaks[ch]:
-                    self.peaks[ch] = value
-                    self.send_message("/channel/%s/peak" % ch, int(value * 16))
-
-                self.send_message("/channel/%s/level" % ch, int(value * 16))
+        if self.meter_interval:
+            now = time.monotonic()
+            # Small tolerance for the jitter of the status updates
+            if now < self._meter_next - self.meter_interval * 0.1:
+                return
+            self._meter_next = max(self._meter_next + self.meter_interval, now)
+
+        self.send_levels()
+
+    def ping_start(self) -> None:
+        # Shared by all handler classes: one thread pings the clients of all servers
+        cls = SLClientHandler
+        with cls._ping_lock:
+            cls._ping_clients.append(self)
+            if cls._ping_thread is None:
+                cls._ping_thread = threading.Thread(target=cls._ping_process, daemon=True)
+                cls._ping_thread.start()
+
+    def ping_stop(self) -> None:
+        with self._ping_lock:
+            if self in self._ping_clients:
+                self._ping_clients.remove(self)
+
+    @classmethod
+    def _ping_process(cls) -> None:
+        "One thread pings all clients, ends with the last client"
+        while True:
+            time.sleep(cls.ping_interval)
+            with cls._ping_lock:
+                clients = list(cls._ping_clients)
+                if not clients:
+                    cls._ping_thread = None
+                    return
+            for client in clients:
+                client.send_ping()
+
+    def send_ping(self) -> None:
+        self.connection_ping = not self.connection_ping
+        self.send_encoded(message_cache.get("/connection_ping", self.connection_ping), "/connection_ping")
+
+    def send_levels(self) -> None:
+        if self.meter_multicast_enabled:
+            self.send_levels_multicast()
+            return
+        if self.meter_format == "blob":
+            self.send_levels_blob()
+            return
+
+        # Meter bundle is encoded once per tick and shared by all clients.
+        # Keyed: a stale meter frame still waiting in the queue is replaced.
+        packet, levels = self.osc_server.shared.get(self._meter_key, self.sl.level_seq, self._meter_build)
+        now = time.monotonic()
+        # Full frame also when the previous frame wasn't written yet: a delta frame can't replace it
+        if now >= self._meter_keyframe_next or "levels" in self.outq:
+            self._meter_keyframe_next = now + self.meter_keyframe
+            self._meter_sent = dict(levels)
+            if levels:
+                self.send_encoded(packet, "levels")
+        else:
+            sent = self._meter_sent
+            changed = [ch for ch, v in levels.items() if abs(v - sent[ch]) > self.meter_deadband or (v == 0 and sent[ch])]
+            if changed:
+                for ch in changed:
+                    sent[ch] = levels[ch]
+                self.send_encoded(encode_bundle([message_cache.get(self.level_addrs[ch], levels[ch]) for ch in changed]), "levels")
+
+        # Per-client suffix
+        for ch, value in levels.items():
+            if value > self.peaks[ch]:
+                self.peaks[ch] = value
+                self.send_message("/channel/%s/peak" % ch, value)
+
+    def _multicast_levels(self) -> tuple[bytes, dict[str, int]]:
+        assert self.meter_multicast
+        packet, levels = self._encode_levels(self.inputs)
+        self.meter_multicast.send(packet)
+        return packet, levels
+
+    def send_levels_multicast(self) -> None:
+        # The first client handling the tick sends the levels to the group
+        packet, levels = self.osc_server.shared.get("multicast", self.sl.level_seq, self._multicast_levels)
+
+        for ch in self.meter_channels:
+            value = levels[ch]
+            if value > self.peaks[ch]:
+                self.peaks[ch] = value
+                self.send_message("/channel/%s/peak" % ch, value)
+
+    def send_levels_blob(self) -> None:
+        # Levels are computed once per tick, the blob is per client: it includes peaks
+        packet, levels = self.osc_server.shared.get(self._meter_key, self.sl.level_seq, self._meter_build)
+
+        peaks = self.peaks
+        peak_changed = False
+        for ch, value in levels.items():
+            if value > peaks[ch]:
+                peaks[ch] = value
+                peak_changed = True
+
+        now = time.monotonic()
+        sent = self._meter_sent
+        if not peak_changed and now < self._meter_keyframe_next:
+            if not any(abs(v - sent[ch]) > self.meter_deadband or (v == 0 and sent[ch]) for ch, v in levels.items()):
+                return
+        else:
+            self._meter_keyframe_next = now + self.meter_keyframe
+        self._meter_sent = dict(levels)
+
+        data = bytes(min(levels[ch], 255) for ch in levels) + bytes(min(max(peaks[ch], 0), 255) for ch in levels)
+        self.send_encoded(encode_blob_message("/meters", data), "levels")
 
     def sl_control_handler(self, channel: str, ctrl: str, value: float) -> None:
         #print("SL Control handler, channel %s, ctrl %s" %( channel, ctrl))
@@ -156,8 +417,10 @@ class SLClientHandler(DispatchedOSCRequestHandler):
 
         if ctrl == "peak_reset":
             self.peaks[ch] = -1
-            self.sl_level_handler()
+            if self.meters_subscribed:
+                self.send_levels()
 
         if ch == "geq0" and ctrl == "reset":
-            for i, ctrl in enumerate(self._get_freqs(ch)):
-                self.sl.set_control(ch, ctrl, 0.5)
+            with self.sl.batch():
+                for ctrl in self.geq_freqs:
+                    self.sl.set_control(ch, ctrl, 0.5)
@@ -0,0 +1,214 @@
+import bisect
+import http.server
+import threading
+
+from typing import Any, Callable, Iterator, Optional, Union
+
+type Labels = tuple[tuple[str, str], ...]
+type Sample = tuple[str, Labels, float]
+
+# Seconds, from a fast adapter transaction up to a stalled FireWire read
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _labels(labels: Optional[dict[str, str]]) -> Labels:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+
+class Counter():
+    "Monotonic count, e.g. of retries or reconnects"
+    kind = "counter"
+
+    def __init__(self, name: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+    def samples(self) -> Iterator[Sample]:
+        yield self.name, self.labels, self.value
+
+
+class Gauge():
+    "Current value, read from the callback when the metrics are exported"
+    kind = "gauge"
+
+    def __init__(self, name: str, fn: Callable[[], float], labels: Labels = ()) -> None:
+        self.name = name
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self) -> Iterator[Sample]:
+        yield self.name, self.labels, self.fn()
+
+
+class Histogram():
+    """Distribution of durations in fixed buckets
+
+    observe() costs a bisect and three increments, cheap enough for the per-transaction paths.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS, labels: Labels = ()) -> None:
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        "Upper bound of the bucket holding the q-quantile (the largest bucket bound for the overflow bucket)"
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            if total >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def samples(self) -> Iterator[Sample]:
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield self.name + "_bucket", self.labels + (("le", repr(bound)),), total
+        yield self.name + "_bucket", self.labels + (("le", "+Inf"),), self.count
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+
+type Metric = Union[Counter, Gauge, Histogram]
+
+
+class Registry():
+    """Named metrics, exported in the Prometheus text format and as OSC /stats messages
+
+    Updates are not locked: a concurrent update may be lost now and then, which is
+    acceptable for statistics and keeps the hot paths free of lock contention.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: dict[tuple[str, Labels], Metric] = {}
+        self._help: dict[str, str] = {}
+
+    def _add(self, metric: Metric, help: str) -> Any:
+        with self._lock:
+            key = (metric.name, metric.labels)
+            existing = self._metrics.get(key)
+            if existing is not None:
+                assert type(existing) is type(metric), "Metric %s registered with another type" % metric.name
+                if not isinstance(metric, Gauge):
+                    return existing
+            self._metrics[key] = metric
+            self._help.setdefault(metric.name, help)
+            return metric
+
+    def counter(self, name: str, help: str = "", labels: Optional[dict[str, str]] = None) -> Counter:
+        return self._add(Counter(name, _labels(labels)), help)
+
+    def gauge(self, name: str, fn: Callable[[], float], help: str = "", labels: Optional[dict[str, str]] = None) -> Gauge:
+        "Gauges are replaced by a new registration of the same name and labels"
+        return self._add(Gauge(name, fn, _labels(labels)), help)
+
+    def histogram(self, name: str, help: str = "", labels: Optional[dict[str, str]] = None,
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, buckets, _labels(labels)), help)
+
+    def remove(self, metric: Metric) -> None:
+        "Unregister a metric, e.g. per-client metrics of a disconnected client"
+        with self._lock:
+            if self._metrics.get((metric.name, metric.labels)) is metric:
+                del self._metrics[(metric.name, metric.labels)]
+
+    def metrics(self) -> list[Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+
+    def render(self) -> str:
+        "Prometheus text exposition format"
+        lines = []
+        name = None
+        for metric in self.metrics():
+            if metric.name != name:
+                name = metric.name
+                if self._help.get(name):
+                    lines.append("# HELP %s %s" % (name, self._help[name]))
+                lines.append("# TYPE %s %s" % (name, metric.kind))
+            try:
+                for sample, labels, value in metric.samples():
+                    lines.append("%s%s %s" % (sample, _format_labels(labels), repr(float(value))))
+            except Exception as e:
+                lines.append("# %s: %s" % (metric.name, e))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[tuple[str, Labels, list[float]]]:
+        """Compact values: counters and gauges as one value, histograms as count, sum, p50 and p99
+
+        Used by the OSC /stats query.
+        """
+        result = []
+        for metric in self.metrics():
+            values: list[float]
+            if isinstance(metric, Histogram):
+                values = [metric.count, metric.sum, metric.quantile(0.5), metric.quantile(0.99)]
+            elif isinstance(metric, Gauge):
+                try:
+                    values = [metric.fn()]
+                except Exception:
+                    continue
+            else:
+                values = [metric.value]
+            result.append((metric.name, metric.labels, [float(v) for v in values]))
+        return result
+
+
+registry = Registry()
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    registry: Registry
+
+    def do_GET(self) -> None:
+        if self.path not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+        data = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class MetricsServer():
+    "HTTP endpoint with the metrics in the Prometheus text format, local only by default"
+    def __init__(self, port: int = 9301, addr: str = "127.0.0.1", metrics: Registry = registry) -> None:
+        handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": metrics})
+        self.server = http.server.ThreadingHTTPServer((addr, port), handler)
+        self.server.daemon_threads = True
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
@@ -1,3 +1,7 @@
-from .server import SharedTCPServer, zc_register_osc_tcp, DispatchedOSCRequestHandler
+from .server import SharedTCPServer, AsyncTCPServer, UDPServer, MulticastSender, zc_register_osc_tcp, zc_register_osc_udp
+from .server import DispatchedOSCRequestHandler, DispatchTable
 
-__all__ = ["SharedTCPServer", "zc_register_osc_tcp", "DispatchedOSCRequestHandler"]
+__all__ = [
+    "SharedTCPServer", "AsyncTCPServer", "UDPServer", "MulticastSender", "zc_register_osc_tcp", "zc_register_osc_udp",
+    "DispatchedOSCRequestHandler", "DispatchTable",
+]
@@ -1,35 +1,222 @@
+import asyncio
+import contextlib
+import functools
+import re
 import socket
 import socketserver
 import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
 
 import netifaces
 
-from typing import Union, Any, Optional, Iterable, Callable
+from typing import Union, Any, Optional, Iterable, Callable, Hashable, TypeVar, ContextManager, Protocol, cast
 
 from pythonosc import osc_packet
 #from pythonosc.osc_message import OscMessage
-from pythonosc.osc_bundle import OscBundle
 from pythonosc.osc_message_builder import OscMessageBuilder
-from pythonosc.osc_bundle_builder import OscBundleBuilder, IMMEDIATELY
+from pythonosc.osc_bundle_builder import IMMEDIATELY
+from pythonosc.parsing import osc_types
 
 from zeroconf import ServiceInfo, Zeroconf
 
+from ..metrics import registry, Histogram, Metric
+
 type BaseOscValue = Union[int, float, bytes, str, bool]
 type OscValue = Union[int, float, bytes, str, bool, list[BaseOscValue]]
 type DORHCallback = Union[Callable[[str, Any, Any], None], Callable[[str, Any], None], Callable[[str], None]]
 
+_BUNDLE_HEADER = b"#bundle\x00" + osc_types.write_date(IMMEDIATELY)
+
+_connects = registry.counter("osc_client_connects_total", "OSC client connections")
+_dispatch = {kind: registry.counter("osc_dispatch_total", "OSC messages received, by dispatch kind", {"kind": kind})
+             for kind in ["client", "direct", "pattern", "unmatched"]}
+
+
+def encode_message(address: str, value: OscValue) -> bytes:
+    "Build OSC message with size prefix (OSC 1.0 stream framing, same as bundle element)"
+    builder = OscMessageBuilder(address=address)
+    values: list[BaseOscValue]
+    if value is None:
+        values = []
+    elif not isinstance(value, Iterable) or isinstance(value, (str, bytes)):
+        values = [value]
+    else:
+        values = value
+
+    for val in values:
+        builder.add_arg(val)
+    msg = builder.build()
+    return msg.size.to_bytes(length=4, byteorder='big') + msg.dgram
+
+
+@functools.lru_cache(maxsize=16)
+def _blob_message_header(address: str) -> bytes:
+    return osc_types.write_string(address) + osc_types.write_string(",b")
+
+
+def encode_blob_message(address: str, data: bytes) -> bytes:
+    "Same as encode_message(address, data), without the generic message builder"
+    dgram = _blob_message_header(address) + osc_types.write_blob(data)
+    return len(dgram).to_bytes(length=4, byteorder='big') + dgram
+
+
+def encode_bundle(elements: Iterable[bytes]) -> bytes:
+    "Build OSC bundle with size prefix from encoded messages"
+    dgram = _BUNDLE_HEADER + b"".join(elements)
+    return len(dgram).to_bytes(length=4, byteorder='big') + dgram
+
+
+def encode_bundles(elements: Iterable[bytes], max_size: int) -> list[bytes]:
+    "Build as few OSC bundles as possible, each of them (without size prefix) up to max_size bytes"
+    bundles = []
+    chunk: list[bytes] = []
+    size = len(_BUNDLE_HEADER)
+    for e in elements:
+        if chunk and size + len(e) > max_size:
+            bundles.append(encode_bundle(chunk))
+            chunk = []
+            size = len(_BUNDLE_HEADER)
+        chunk.append(e)
+        size += len(e)
+    if chunk:
+        bundles.append(encode_bundle(chunk))
+    return bundles
+
+
+class OscMessageCache():
+    """Pre-encoded messages keyed by (address, value), for messages with a small set of values
+
+    The value type is part of the key, True and 1 are encoded differently.
+    """
+    def __init__(self, maxsize: int = 8192) -> None:
+        self.maxsize = maxsize
+        self._cache: dict[tuple[str, type, BaseOscValue], bytes] = {}
+
+    def get(self, address: str, value: BaseOscValue) -> bytes:
+        key = (address, type(value), value)
+        data = self._cache.get(key)
+        if data is None:
+            data = encode_message(address, value)
+            if len(self._cache) < self.maxsize:
+                self._cache[key] = data
+        return data
+
+
+message_cache = OscMessageCache()
+
+T = TypeVar("T")
+
+
+class SharedPackets():
+    """Packets shared by all clients of a server, built once per sequence number
+
+    All clients asking for the same key and sequence number (e.g. a status tick)
+    get the very same object, so the encoding work does not grow with client count.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._packets: dict[Hashable, tuple[int, Any]] = {}
+
+    def get(self, key: Hashable, seq: int, build: Callable[[], T]) -> T:
+        with self._lock:
+            packet = self._packets.get(key)
+            if packet is None or packet[0] != seq:
+                packet = (seq, build())
+                self._packets[key] = packet
+            return packet[1]
+
+
+class OSCServer(Protocol):
+    "Attributes of the servers (TCP, asyncio TCP, UDP) used by the request handlers"
+    protocol: str
+    clients: list[socketserver.BaseRequestHandler]
+    shared: SharedPackets
+
+    def start_writer(self, handler: "ThreadedTCPOSCRequestHandler") -> None: ...
+
+
+class OutboundQueue():
+    """Bounded queue of framed OSC packets waiting for the client writer
+
+    A packet put with a key replaces the pending packet with the same key,
+    so only the latest value of an address (or the latest meter frame) is sent.
+    The replacement takes the position of the newest packet: it must not
+    overtake packets queued after the replaced one (e.g. a state snapshot).
+    When the queue is full, the oldest pending packet is dropped.
+    """
+    def __init__(self, maxlen: int = 2048) -> None:
+        self.maxlen = maxlen
+        self.on_put: Optional[Callable[[], None]] = None
+
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._cond = threading.Condition()
+        self._items: dict[Hashable, bytes] = {}
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        "Packet with the key is waiting for the writer"
+        return key in self._items
+
+    def put(self, data: bytes, key: Hashable = None) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            if key is None:
+                key = object()
+            elif key in self._items:
+                self.coalesced += 1
+                del self._items[key]
+                self._items[key] = data
+                return
+
+            if len(self._items) >= self.maxlen:
+                del self._items[next(iter(self._items))]
+                self.dropped += 1
+            self._items[key] = data
+            self._cond.notify()
+
+        if self.on_put:
+            self.on_put()
+
+    def get(self, block: bool = True) -> list[bytes]:
+        "Take all pending packets, returns empty list when closed (or empty and not blocking)"
+        with self._cond:
+            while block and not self._items and not self._closed:
+                self._cond.wait()
+            items = list(self._items.values())
+            self._items.clear()
+            return items
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._cond.notify_all()
+
 
 class ThreadedTCPOSCRequestHandler(socketserver.BaseRequestHandler):
-    _bundle: Optional[list[Any]]
-    server: "ThreadedTCPServer"
+    _bundle: Optional[list[bytes]]
+
+    queue_size = 2048
+    max_bundle_size = 4096
 
     class BundleManager:
-        def __init__(self, request_handler: "ThreadedTCPOSCRequestHandler") -> None:
+        def __init__(self, request_handler: "ThreadedTCPOSCRequestHandler", key: Hashable = None) -> None:
             self._rh = request_handler
+            self._key = key
 
         def __enter__(self) -> None:
             if self._rh._bundle_inner == 0:
                 self._rh._bundle = []
+                self._rh._bundle_key = self._key
             self._rh._bundle_inner += 1
 
         def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
@@ -38,16 +225,60 @@ class ThreadedTCPOSCRequestHandler(socketserver.BaseRequestHandler):
                 if self._rh._bundle:
                     bundle = self._rh._bundle
                     self._rh._bundle = None
-                    self._rh.send_bundle(bundle)
+                    self._rh.send_bundle(bundle, self._rh._bundle_key)
+
+    @property
+    def osc_server(self) -> OSCServer:
+        "The server, typed: handlers are served by ThreadedTCPServer, AsyncTCPServer or UDPServer"
+        return cast(OSCServer, self.server)
 
     def setup(self) -> None:
         super().setup()
-        print("OSC TCP client connected", self.client_address)
+        print("OSC %s client connected" % self.osc_server.protocol, self.client_address)
 
         self._bundle = None
         self._bundle_inner = 0
+        self._bundle_key: Hashable = None
+
+        self.sync_start = time.monotonic()
+        self.sync_time: Optional[float] = None
+        self._sync_packet: Optional[bytes] = None
+
+        self.outq = OutboundQueue(self.queue_size)
+
+        labels = {"protocol": self.osc_server.protocol, "client": "%s:%s" % tuple(self.client_address[:2])}
+        self.send_time = registry.histogram("osc_client_send_seconds", "Write of the pending packets to the client socket", labels)
+        self._metrics: list[Metric] = [
+            self.send_time,
+            registry.gauge("osc_client_queue_depth", lambda: len(self.outq), "Packets waiting for the client writer", labels),
+            registry.gauge("osc_client_dropped", lambda: self.outq.dropped, "Packets dropped by the full client queue", labels),
+            registry.gauge("osc_client_coalesced", lambda: self.outq.coalesced, "Packets replaced by a newer one in the client queue", labels),
+        ]
+        _connects.inc()
 
-        self.server.clients.append(self)
+        self.osc_server.start_writer(self)
+
+        self.osc_server.clients.append(self)
+
+    def writer_process(self) -> None:
+        while True:
+            packets = self.outq.get()
+            if not packets:
+                break
+            start = time.monotonic()
+            try:
+                self.request.sendall(b"".join(packets))
+            except OSError:
+                break
+            self.send_time.observe(time.monotonic() - start)
+            self.written(packets)
+
+    def written(self, packets: list[bytes]) -> None:
+        "Called by the writer after packets are passed to the socket"
+        if self._sync_packet is not None and any(p is self._sync_packet for p in packets):
+            self._sync_packet = None
+            self.sync_time = time.monotonic() - self.sync_start
+            print("OSC %s client synced" % self.osc_server.protocol, self.client_address, "in %.1f ms" % (self.sync_time * 1000))
 
     def _recv(self, size: int) -> Optional[bytes]:
         data = b''
@@ -68,72 +299,202 @@ class ThreadedTCPOSCRequestHandler(socketserver.BaseRequestHandler):
             if data is None:
                 break
 
-            for m in osc_packet.OscPacket(data).messages:
-                self.handle_message(m.message.address, m.message.params)
+            self.handle_packet(data)
+
+    def handle_packet(self, data: bytes) -> None:
+        for m in osc_packet.OscPacket(data).messages:
+            self.handle_message(m.message.address, m.message.params)
 
     def finish(self) -> None:
-        print("OSC TCP client disconnected", self.client_address)
-        self.server.clients.remove(self)
+        print("OSC %s client disconnected" % self.osc_server.protocol, self.client_address, "(dropped %d, coalesced %d)" % (self.outq.dropped, self.outq.coalesced))
+        self.osc_server.clients.remove(self)
+        self.outq.close()
+        for metric in self._metrics:
+            registry.remove(metric)
         super().finish()
 
     def handle_message(self, address: str, value: OscValue) -> None:
         pass
 
-    def bundle(self) -> BundleManager:
-        return self.BundleManager(self)
+    @property
+    def queue_depth(self) -> int:
+        return len(self.outq)
+
+    def bundle(self, key: Hashable = None) -> BundleManager:
+        "Group messages into one bundle, a bundle with key replaces the pending one with the same key"
+        return self.BundleManager(self, key)
+
+    def send_bundle(self, elements: list[bytes], key: Hashable = None) -> None:
+        self.outq.put(encode_bundle(elements), key)
 
-    def send_bundle(self, msg_list: list[OscBundle]) -> None:
-        bb = OscBundleBuilder(IMMEDIATELY)
-        for msg in msg_list:
-            bb.add_content(msg)
-        bundle = bb.build()
-        self.request.sendall(bundle.size.to_bytes(length=4, byteorder='big') + bundle.dgram)
+    def send_encoded(self, data: bytes, key: Hashable = None) -> None:
+        "Send message encoded by encode_message() or OscMessageCache"
+        if self._bundle is None:
+            self.outq.put(data, key)
+        else:
+            self._bundle.append(data)
 
     def send_message(self, address: str, value: OscValue) -> None:
-        builder = OscMessageBuilder(address=address)
-        values: list[BaseOscValue]
-        if value is None:
-            values = []
-        elif not isinstance(value, Iterable) or isinstance(value, (str, bytes)):
-            values = [value]
+        self.send_encoded(encode_message(address, value), address)
+
+    def send_snapshot(self, packets: list[bytes]) -> None:
+        "Send full state packets, sync_time is measured from sync_start until they are written"
+        for packet in packets:
+            self.outq.put(packet)
+        if packets:
+            self._sync_packet = packets[-1]
+
+
+_PATTERN_CHARS = re.compile(r"[*?\[{]")
+
+
+def is_pattern(address: str) -> bool:
+    return _PATTERN_CHARS.search(address) is not None
+
+
+@functools.lru_cache(maxsize=256)
+def compile_pattern(part: str) -> re.Pattern[str]:
+    "Translate one part (between slashes) of OSC 1.0 address pattern to regex"
+    regex = ""
+    i = 0
+    while i < len(part):
+        c = part[i]
+        end = part.find("]" if c == "[" else "}", i + 1) if c in "[{" else -1
+        if c == "*":
+            regex += ".*"
+        elif c == "?":
+            regex += "."
+        elif c == "[" and end > 0:
+            chars = part[i + 1:end]
+            negate = chars.startswith("!")
+            if negate:
+                chars = chars[1:]
+            chars = "".join("\\" + x if x in "\\^[]" else x for x in chars)
+            regex += ("[%s%s]" % ("^" if negate else "", chars)) if chars else "(?!)"
+            i = end
+        elif c == "{" and end > 0:
+            regex += "(?:" + "|".join(re.escape(x) for x in part[i + 1:end].split(",")) + ")"
+            i = end
         else:
-            values = value
+            regex += re.escape(c)
+        i += 1
+    return re.compile(regex)
 
-        for val in values:
-            builder.add_arg(val)
-        msg = builder.build()
 
-        if self._bundle is None:
-            try:
-                self.request.sendall(msg.size.to_bytes(length=4, byteorder='big') + msg._dgram)
-            except Exception:
-                pass
-        else:
-            self._bundle.append(msg)
+class _DispatchNode():
+    __slots__ = ("children", "path")
+
+    def __init__(self) -> None:
+        self.children: dict[str, "_DispatchNode"] = {}
+        self.path: Optional[str] = None
+
+
+class DispatchTable():
+    """Routing of OSC addresses, built once and shared read-only by all connections
+
+    Callbacks are unbound handler methods, called as callback(handler, address, args, *values)
+    or callback(handler, address, *values) when mapped without args.
+    Address patterns are resolved through a tree of address parts, so only matching branches are visited.
+    """
+    def __init__(self) -> None:
+        self.maps: dict[str, tuple[Callable[..., None], tuple[Any, ...]]] = {}
+        self._tree = _DispatchNode()
+
+    def map(self, path: str, callback: Callable[..., None], *args: Any) -> None:
+        self.maps[path] = (callback, args)
+
+        node = self._tree
+        for part in path.split("/")[1:]:
+            node = node.children.setdefault(part, _DispatchNode())
+        node.path = path
+
+    def match(self, pattern: str) -> list[str]:
+        "Return all mapped paths matching the OSC address pattern"
+        nodes = [self._tree]
+        for part in pattern.split("/")[1:]:
+            if not is_pattern(part):
+                nodes = [n.children[part] for n in nodes if part in n.children]
+            else:
+                regex = compile_pattern(part)
+                nodes = [c for n in nodes for name, c in n.children.items() if regex.fullmatch(name)]
+            if not nodes:
+                return []
+        return [n.path for n in nodes if n.path is not None]
 
 
 class DispatchedOSCRequestHandler(ThreadedTCPOSCRequestHandler):
+    dispatcher: Optional[DispatchTable]
+
     def map(self, path: str, callback: DORHCallback, *args: Any) -> None:
+        "Map path for this connection only, takes precedence over the shared dispatcher"
         self._dispatcher_maps[path] = (callback, args)
 
+    def get_dispatcher(self) -> Optional[DispatchTable]:
+        return None
+
+    def dispatch_group(self) -> ContextManager[Any]:
+        "Context for all messages matched by one address pattern"
+        return contextlib.nullcontext()
+
     def setup(self) -> None:
         super().setup()
         self._dispatcher_maps: dict[str, tuple[DORHCallback, Any]] = {}
+        self.dispatcher = self.get_dispatcher()
 
     def handle_message(self, address: str, value: OscValue) -> None:
+        callback: Any  # DORHCallback
         mapping = self._dispatcher_maps.get(address)
         if mapping:
-            callback: Any  # DORHCallback
             callback, args = mapping
+            _dispatch["client"].inc()
             if args:
                 callback(address, args, *value)
             else:
                 callback(address, *value)
+        elif self.dispatcher:
+            shared = self.dispatcher.maps.get(address)
+            if shared:
+                _dispatch["direct"].inc()
+                callback, args = shared
+                if args:
+                    callback(self, address, args, *value)
+                else:
+                    callback(self, address, *value)
+            elif is_pattern(address):
+                _dispatch["pattern"].inc()
+                with self.dispatch_group():
+                    for path in self.dispatcher.match(address):
+                        callback, args = self.dispatcher.maps[path]
+                        if args:
+                            callback(self, path, args, *value)
+                        else:
+                            callback(self, path, *value)
+            else:
+                _dispatch["unmatched"].inc()
+        else:
+            _dispatch["unmatched"].inc()
+
+
+def set_nodelay(sock: socket.socket) -> None:
+    "Send small packets (control echoes) at once, Nagle would hold them for the delayed ACK of the client"
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
+    protocol = "TCP"
     clients: list[socketserver.BaseRequestHandler]
+    shared: SharedPackets
+
+    def get_request(self) -> tuple[socket.socket, Any]:
+        request, client_address = super().get_request()
+        set_nodelay(request)
+        return request, client_address
+
+    def start_writer(self, handler: ThreadedTCPOSCRequestHandler) -> None:
+        t = threading.Thread(target=handler.writer_process)
+        t.daemon = True
+        t.start()
 
 
 class SharedTCPServer():
@@ -141,9 +502,13 @@ class SharedTCPServer():
 
     def __init__(self, RequestHandler: type[socketserver.BaseRequestHandler], port: int = 4301, addr: str = "0.0.0.0"):
         self.clients = []
+        self.shared = SharedPackets()
+
+        registry.gauge("osc_clients", lambda: len(self.clients), "Connected OSC clients", {"protocol": "TCP"})
 
         self.server = ThreadedTCPServer((addr, port), RequestHandler)
         self.server.clients = self.clients
+        self.server.shared = self.shared
         self.server_thread = threading.Thread(target=self.server.serve_forever)
         self.server_thread.daemon = True
         self.server_thread.start()
@@ -157,9 +522,291 @@ class SharedTCPServer():
             finally:
                 c.request.close()
         self.server.shutdown()
+        self.server.server_close()
         self.server_thread.join()
 
 
+class _AsyncioRequest():
+    """Socket-like wrapper of the asyncio transport, used as handler.request
+
+    Writes are scheduled into the event loop, so callers from any thread never block.
+    The outbound queue is flushed by the loop while the transport is not paused.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, transport: asyncio.Transport) -> None:
+        self._loop = loop
+        self._transport = transport
+        self._outq: Optional[OutboundQueue] = None
+        self._scheduled = False
+        self.paused = False
+
+    def start_writer(self, outq: OutboundQueue, written: Callable[[list[bytes]], None], send_time: Histogram) -> None:
+        self._outq = outq
+        self._written = written
+        self._send_time = send_time
+        outq.on_put = self._wakeup
+
+    def _wakeup(self) -> None:
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self.flush)
+
+    def flush(self) -> None:
+        self._scheduled = False
+        if self.paused or self._outq is None or self._transport.is_closing():
+            return
+        packets = self._outq.get(block=False)
+        if packets:
+            start = time.monotonic()
+            self._transport.write(b"".join(packets))
+            self._send_time.observe(time.monotonic() - start)
+            self._written(packets)
+
+    def sendall(self, data: bytes) -> None:
+        self._loop.call_soon_threadsafe(self._transport.write, data)
+
+    def shutdown(self, how: int) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._transport.close)
+
+
+class _AsyncioOSCProtocol(asyncio.Protocol):
+    def __init__(self, server: "AsyncTCPServer") -> None:
+        self._server = server
+        self._buffer = bytearray()
+        self._handler: Optional[ThreadedTCPOSCRequestHandler] = None
+        self._request: Optional[_AsyncioRequest] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            set_nodelay(sock)
+        # Same attributes as socketserver.BaseRequestHandler.__init__, without running handle()
+        RequestHandler = self._server.RequestHandlerClass
+        handler = RequestHandler.__new__(RequestHandler)
+        assert isinstance(handler, ThreadedTCPOSCRequestHandler)
+        peer: tuple[str, int] = transport.get_extra_info('peername')
+        handler.request = self._request = _AsyncioRequest(self._server.loop, transport)
+        handler.client_address = peer
+        handler.server = cast(socketserver.BaseServer, self._server)
+        self._handler = handler
+        self._server.dispatch(handler.setup)
+
+    def data_received(self, data: bytes) -> None:
+        assert self._handler
+        buf = self._buffer
+        buf += data
+        while len(buf) >= 4:
+            size = int.from_bytes(buf[:4], byteorder='big')
+            if len(buf) < size + 4:
+                break
+            packet = bytes(buf[4:size + 4])
+            del buf[:size + 4]
+            self._server.dispatch(self._handler.handle_packet, packet)
+
+    def pause_writing(self) -> None:
+        assert self._request
+        self._request.paused = True
+
+    def resume_writing(self) -> None:
+        assert self._request
+        self._request.paused = False
+        self._request.flush()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._handler:
+            self._server.dispatch(self._handler.finish)
+            self._handler = None
+
+
+class AsyncTCPServer():
+    """OSC TCP server serving all clients from a single asyncio event loop
+
+    Incoming messages are dispatched in order by one worker thread, so the
+    (possibly blocking) backend calls do not stall the event loop.
+    """
+    clients: list[socketserver.BaseRequestHandler]
+    protocol = "TCP"
+
+    def __init__(self, RequestHandler: type[socketserver.BaseRequestHandler], port: int = 4301, addr: str = "0.0.0.0"):
+        self.clients = []
+        self.shared = SharedPackets()
+        self.RequestHandlerClass = RequestHandler
+        registry.gauge("osc_clients", lambda: len(self.clients), "Connected OSC clients", {"protocol": self.protocol})
+
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="osc-dispatch")
+
+        coro = self.loop.create_server(lambda: _AsyncioOSCProtocol(self), addr, port, reuse_address=True)
+        self.server = self.loop.run_until_complete(coro)
+        self.server_thread = threading.Thread(target=self.loop.run_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def start_writer(self, handler: ThreadedTCPOSCRequestHandler) -> None:
+        assert isinstance(handler.request, _AsyncioRequest)
+        handler.request.start_writer(handler.outq, handler.written, handler.send_time)
+
+    def dispatch(self, fn: Callable[..., None], *args: Any) -> None:
+        def call() -> None:
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+        self._executor.submit(call)
+
+    async def _close(self) -> None:
+        self.server.close()
+        for c in list(self.clients):
+            c.request.close()
+        await self.server.wait_closed()
+
+    def shutdown(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.server_thread.join()
+        self._executor.shutdown(wait=True)
+
+
+def _sendto_framed(sock: socket.socket, data: bytes, address: tuple[str, int]) -> None:
+    "Send OSC 1.0 framed packets, each one as a datagram"
+    view = memoryview(data)
+    pos = 0
+    while pos + 4 <= len(view):
+        size = int.from_bytes(view[pos:pos + 4], byteorder='big')
+        sock.sendto(view[pos + 4:pos + 4 + size], address)
+        pos += 4 + size
+
+
+class _UDPRequest():
+    "Socket-like wrapper used as handler.request of an OSC UDP client"
+    def __init__(self, sock: socket.socket, address: tuple[str, int]) -> None:
+        self._sock = sock
+        self._address = address
+
+    def sendall(self, data: bytes) -> None:
+        _sendto_framed(self._sock, data, self._address)
+
+    def shutdown(self, how: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class UDPServer():
+    """OSC UDP server with the request handler API of the TCP servers
+
+    Each remote address gets its own handler, set up on the first datagram.
+    Handlers live until shutdown by default: a listen-only client (e.g. meters
+    on a tablet) sends nothing after subscribing. With client_timeout set, the
+    handler is finished after that many seconds without any datagram from the
+    client, so clients must send a keepalive (any message) more often.
+    Packets from all clients are handled in order by the receiving thread.
+    """
+    clients: list[socketserver.BaseRequestHandler]
+    protocol = "UDP"
+
+    def __init__(self, RequestHandler: type[socketserver.BaseRequestHandler], port: int = 4301, addr: str = "0.0.0.0",
+                 client_timeout: Optional[float] = None):
+        self.client_timeout = client_timeout
+        self.clients = []
+        self.shared = SharedPackets()
+        self.RequestHandlerClass = RequestHandler
+        registry.gauge("osc_clients", lambda: len(self.clients), "Connected OSC clients", {"protocol": self.protocol})
+
+        self._handlers: dict[tuple[str, int], ThreadedTCPOSCRequestHandler] = {}
+        self._last_seen: dict[tuple[str, int], float] = {}
+        self._stop_event = threading.Event()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((addr, port))
+        self.socket.settimeout(1)
+
+        self.server_thread = threading.Thread(target=self._serve)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def start_writer(self, handler: ThreadedTCPOSCRequestHandler) -> None:
+        t = threading.Thread(target=handler.writer_process)
+        t.daemon = True
+        t.start()
+
+    def _serve(self) -> None:
+        next_expire = time.monotonic() + 1
+        while not self._stop_event.is_set():
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except socket.timeout:
+                data = b""
+            except OSError:
+                break
+
+            now = time.monotonic()
+            if data:
+                handler = self._handlers.get(address)
+                try:
+                    if handler is None:
+                        handler = self._setup(address)
+                    self._last_seen[address] = now
+                    handler.handle_packet(data)
+                except Exception:
+                    traceback.print_exc()
+
+            if self.client_timeout and now >= next_expire:
+                next_expire = now + 1
+                for address, last_seen in list(self._last_seen.items()):
+                    if now - last_seen > self.client_timeout:
+                        self._finish(address)
+
+    def _setup(self, address: tuple[str, int]) -> ThreadedTCPOSCRequestHandler:
+        # Same attributes as socketserver.BaseRequestHandler.__init__, without running handle()
+        RequestHandler = self.RequestHandlerClass
+        handler = RequestHandler.__new__(RequestHandler)
+        assert isinstance(handler, ThreadedTCPOSCRequestHandler)
+        handler.request = _UDPRequest(self.socket, address)
+        handler.client_address = address
+        handler.server = cast(socketserver.BaseServer, self)
+        self._handlers[address] = handler
+        handler.setup()
+        return handler
+
+    def _finish(self, address: tuple[str, int]) -> None:
+        handler = self._handlers.pop(address)
+        del self._last_seen[address]
+        try:
+            handler.finish()
+        except Exception:
+            traceback.print_exc()
+
+    def shutdown(self) -> None:
+        self._stop_event.set()
+        self.server_thread.join()
+        for address in list(self._handlers):
+            self._finish(address)
+        self.socket.close()
+
+
+class MulticastSender():
+    "Sends OSC 1.0 framed packets as datagrams to a multicast group"
+    def __init__(self, group: str, port: int = 4302, ttl: int = 1) -> None:
+        self.address = (group, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+
+    def send(self, data: bytes) -> None:
+        try:
+            _sendto_framed(self.socket, data, self.address)
+        except OSError as e:
+            print("OSC multicast send failed:", e)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
 def getIPv4Addresses() -> dict[str, Any]:
     ret = {}
     for i in netifaces.interfaces():
@@ -172,14 +819,21 @@ def getIPv4Addresses() -> dict[str, Any]:
     return ret
 
 
-def zc_register_osc_tcp(port: int = 4301, oscname: str = "OSCLive") -> list[tuple[Zeroconf, ServiceInfo]]:
-    zc_service = "_osc._tcp.local."
+def zc_register_osc_tcp(port: int = 4301, oscname: str = "OSCLive", properties: Optional[dict[str, str]] = None) -> list[tuple[Zeroconf, ServiceInfo]]:
+    return zc_register_osc("_osc._tcp.local.", port, oscname, properties)
+
+
+def zc_register_osc_udp(port: int = 4301, oscname: str = "OSCLive", properties: Optional[dict[str, str]] = None) -> list[tuple[Zeroconf, ServiceInfo]]:
+    return zc_register_osc("_osc._udp.local.", port, oscname, properties)
+
+
+def zc_register_osc(zc_service: str, port: int, oscname: str, properties: Optional[dict[str, str]] = None) -> list[tuple[Zeroconf, ServiceInfo]]:
     zc_name = oscname + "." + zc_service
     zc_svcs = []
     # Workaround to publish all IP addresses
     for ifname, ip in getIPv4Addresses().items():
         zc_name = f"{oscname}_{ifname}.{zc_service}"
-        si = ServiceInfo(zc_service, zc_name, port, addresses=[ip])
+        si = ServiceInfo(zc_service, zc_name, port, addresses=[ip], properties=properties or {})
         zc = Zeroconf([ip])
         zc.register_service(si)
         print("Zeroconf register %s on IP %s" % (zc_name, ip))
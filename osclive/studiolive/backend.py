@@ -1,13 +1,21 @@
 import threading
+import time
 
+from contextlib import contextmanager
 from dataclasses import dataclass, KW_ONLY
-from typing import Optional, Callable
+from typing import Optional, Callable, Iterator
+
+from ..metrics import registry
+from .trace import TraceBuffer, CONTROL_IN
 
 type SLValue = float
 
 type SLUpdateCallback = Callable[[str, str, SLValue], None]
 type SLLevelCallback = Callable[[], None]
 
+_level_updates = registry.counter("studiolive_level_updates_total", "Meter level updates received from the mixer")
+_control_updates = registry.counter("studiolive_control_updates_total", "Control changes received from the mixer")
+
 
 @dataclass
 class SLBaseChannel:
@@ -54,6 +62,10 @@ class SLBackend:
         self.update_thread: Optional[threading.Thread] = None
         self._stop_event = threading.Event()
         self.channels: dict[str, SLChannel]
+        self.level_seq = 0
+        self.state_seq = 0
+        self.last_change = 0.0  # time.monotonic() of the last user visible control change
+        self.trace: Optional[TraceBuffer] = None
 
     def set_listener(self, listener: SLListener) -> None:
         self.listener = listener
@@ -67,16 +79,29 @@ class SLBackend:
             self.update_thread.join()
 
     def _update_levels(self) -> None:
-        for callback in self.listener.level_callbacks:
+        self.level_seq += 1
+        _level_updates.inc()
+        # Copy: clients (un)subscribe from other threads
+        for callback in list(self.listener.level_callbacks):
             callback()
 
     def set_control(self, ch: SLChannel, control: str, value: SLValue) -> None:
         pass
 
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        "Group set_control calls, the backend may write each modified channel just once"
+        yield
+
     def _update_control(self, ch: SLChannel, control: str, value: SLValue) -> bool:
         if ch.ctrls[control] != value:
             ch.ctrls[control] = value
+            self.state_seq += 1
+            _control_updates.inc()
             if not ch.name.startswith("_") and not control.startswith("_"):
+                self.last_change = time.monotonic()
+                if self.trace:
+                    self.trace.control(CONTROL_IN, ch.name, control, value)
                 if self.debug:
                     print("StudioLive: Upd %-8s %-14s = %.3f" % (ch.name + ":", control, value))
                 for callback in self.listener.update_callbacks:
@@ -0,0 +1,145 @@
+import math
+import random
+import threading
+import time
+
+from typing import Optional
+
+from .raw import RawStudioLiveDevice, RawBaseChannel, RawInputChannel, RawStatus, RawFaders, SLNibblePair, SLBit, SLShortInt
+from .rawbackend import AbstractAdapter
+
+
+ACK = b"\xf0\x10\xf7"
+
+
+class EmulatorAdapter(AbstractAdapter):
+    """Software StudioLive speaking the raw SysEx protocol
+
+    Channel blocks are served from the device tables and updated by writes.
+    Changes made on the emulated console ("fader storm") are reported by the
+    modified bits of the status block, which are cleared by each status read.
+    The status block also carries synthetic meter levels.
+    """
+    def __init__(self, device: type[RawStudioLiveDevice], latency: float = 0.001, storm: float = 0,
+                 seed: Optional[int] = None) -> None:
+        self.device = device
+        self.latency = latency      # seconds per transaction
+        self.storm = storm          # console fader moves per second
+
+        self.blocks = {name: bytearray(info.length) for name, info in device.channels.items()}
+        self._reads = {info.read_id: name for name, info in device.channels.items() if info.read_id}
+        self._writes = {info.write_id: name for name, info in device.channels.items() if info.write_id}
+        self._status = next(name for name, info in device.channels.items() if isinstance(info, RawStatus))
+        self._faders = next((name for name, info in device.channels.items() if isinstance(info, RawFaders)), None)
+        self._inputs = [name for name, info in device.channels.items() if isinstance(info, RawInputChannel) and "gain" in info.ctrls]
+
+        status = device.channels[self._status]
+        # Modified bit of each channel: status control name -> channel name, from the device description
+        self._modified: dict[str, tuple[int, int]] = {}
+        for ctrl, name in device.status_modified.items():
+            pos = status.ctrls[ctrl]
+            assert isinstance(pos, SLBit)
+            self._modified[name] = (pos.byte - status.offset, 1 << pos.bit)
+        self._levels = [pos.byte - status.offset for name, pos in status.ctrls.items() if name.startswith("_level_") and isinstance(pos, SLShortInt)]
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._response = memoryview(b"")
+        self._storm_next = time.monotonic()
+
+        self.transactions = 0
+        self.writes = 0
+        self.storm_moves = 0
+
+    def write(self, wd: bytes) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.transactions += 1
+            if self.storm:
+                self._storm_step(time.monotonic())
+
+            wd = bytes(wd)
+            if not wd.startswith(b"\xf0") or 0xf7 not in wd:
+                self._response = memoryview(b"")
+                return
+            cmd = wd[1:wd.index(0xf7)]
+
+            name = self._reads.get(cmd)
+            if name is not None:
+                info = self.device.channels[name]
+                if name == self._status:
+                    self._update_status()
+                self._response = memoryview(b"\xf0" + info.resp_id + self.blocks[name] + b"\xf7")
+                if name == self._status:
+                    self._clear_modified()
+                return
+
+            for n in range(1, 4):
+                name = self._writes.get(cmd[:n])
+                if name is not None and len(cmd) == n + self.device.channels[name].length + 1:
+                    self._write_block(name, cmd[n:-1])
+                    break
+
+            self._response = memoryview(ACK)
+
+    def read(self, num_bytes: int) -> memoryview:
+        return self._response
+
+    def _write_block(self, name: str, data: bytes) -> None:
+        self.writes += 1
+        self.blocks[name][:] = data
+        info = self.device.channels[name]
+        if isinstance(info, RawInputChannel) and name in self._inputs:
+            self._mirror_fader(info, name)
+
+    def _set_nibble_pair(self, name: str, pos: SLNibblePair, value: int) -> None:
+        b = pos.byte - self.device.channels[name].offset
+        self.blocks[name][b:b + 2] = bytes(((value >> 4) & 0x0f, value & 0x0f))
+
+    def _mirror_fader(self, info: RawBaseChannel, name: str) -> None:
+        # The fader block holds the gain nibble pairs of all input channels
+        if self._faders is None:
+            return
+        pos = info.ctrls["gain"]
+        b = pos.byte - info.offset
+        self.blocks[self._faders][info.index * 2:info.index * 2 + 2] = self.blocks[name][b:b + 2]
+
+    def _set_modified(self, name: str) -> None:
+        if name in self._modified:
+            b, mask = self._modified[name]
+            self.blocks[self._status][b] |= mask
+
+    def _clear_modified(self) -> None:
+        for b, mask in self._modified.values():
+            self.blocks[self._status][b] &= mask ^ 0xff
+
+    def _update_status(self) -> None:
+        # Synthetic meters: slow swell per channel with some noise
+        now = time.monotonic()
+        status = self.blocks[self._status]
+        for i, b in enumerate(self._levels):
+            level = 64 + 40 * math.sin(now * (0.5 + i / 10) + i) + self._random.uniform(-20, 20)
+            status[b] = max(0, min(127, int(level)))
+
+    def _storm_step(self, now: float) -> None:
+        """Move the console faders, as someone riding the physical console would"""
+        if now < self._storm_next or not self._inputs:
+            return
+        # Don't try to catch up after long pauses between transactions
+        moves = min(int((now - self._storm_next) * self.storm) + 1, max(1, int(self.storm)))
+        self._storm_next = max(self._storm_next + moves / self.storm, now - 1)
+
+        for _ in range(moves):
+            name = self._random.choice(self._inputs)
+            info = self.device.channels[name]
+            pos = info.ctrls["gain"]
+            assert isinstance(pos, SLNibblePair)
+            value = int(127.5 + 127.5 * math.sin(now * 2 + info.index))
+            self._set_nibble_pair(name, pos, value)
+            self._mirror_fader(info, name)
+            self._set_modified(name)
+            if self._faders is not None:
+                self._set_modified(self._faders)
+            self.storm_moves += 1
@@ -1,10 +1,15 @@
 from dataclasses import dataclass, field, KW_ONLY
-from typing import Union
+from typing import Any, Union, Optional, Iterable, Iterator
 
-from .backend import SLChannel, SLTypeFloat, SLType
+from .backend import SLChannel, SLTypeFloat, SLTypeGain, SLType, SLValue
 
 
-def dfl(data: list[int]) -> list[int]:
+# Raw block data: received frames are memoryviews, channel buffers bytearrays
+type RawData = bytes | bytearray | memoryview
+
+
+def dfl(data: list[int]) -> Any:
+    "Default of an ID field: list with C_INDEX placeholders, converted to bytes by __post_init__"
     return field(default_factory=lambda : data.copy())
 
 
@@ -31,82 +36,166 @@ class SLBit:
 
 C_INDEX = 0xBEEF
 
+type RawCtrl = Union[SLNibblePair, SLBit, SLShortInt]
+
+
+class RawDecoder:
+    """Decoder of one raw block layout
+
+    Compiled once per layout: every control is reduced to a (name, kind, byte, arg)
+    tuple and every byte of the block maps to the controls stored in it, so only
+    the controls touched by changed bytes are decoded.
+    """
+    NIBBLE_PAIR, SHORT_INT, BIT = range(3)
+
+    _compiled: dict[tuple[int, int, int], tuple[dict[str, RawCtrl], "RawDecoder"]] = {}
+
+    def __init__(self, ctrls: dict[str, RawCtrl], offset: int, length: int) -> None:
+        self.length = length
+        self.ctrls: list[tuple[str, int, int, int]] = []
+        index: list[list[int]] = [[] for _ in range(length)]
+
+        for name, pos in ctrls.items():
+            b = pos.byte - offset
+            ctrl: tuple[str, int, int, int]
+            if isinstance(pos, SLNibblePair):
+                # arg: scale the 0 - 255 raw value to 0 - 1
+                ctrl = (name, self.NIBBLE_PAIR, b, int(pos.dataType in [SLTypeFloat, SLTypeGain]))
+                used = [b, b + 1]
+            elif isinstance(pos, SLShortInt):
+                ctrl = (name, self.SHORT_INT, b, 0)
+                used = [b]
+            elif isinstance(pos, SLBit):
+                ctrl = (name, self.BIT, b, 1 << pos.bit)
+                used = [b]
+            else:
+                print("StudioLive: Unknown control type")
+                continue
+
+            for i in used:
+                index[i].append(len(self.ctrls))
+            self.ctrls.append(ctrl)
+
+        self.index = [tuple(i) for i in index]
+
+    @classmethod
+    def compile(cls, ctrls: dict[str, RawCtrl], offset: int, length: int) -> "RawDecoder":
+        # Channels of one type share the ctrls dict, share the decoder too
+        key = (id(ctrls), offset, length)
+        if key not in cls._compiled:
+            cls._compiled[key] = (ctrls, cls(ctrls, offset, length))
+        return cls._compiled[key][1]
+
+    def diff(self, old: RawData, new: RawData) -> Optional[list[int]]:
+        """Return the changed byte positions, None when the whole block must be decoded"""
+        if old == new:
+            return []
+        if len(old) != len(new):
+            return None
+        return [i for i, (a, b) in enumerate(zip(old, new)) if a != b]
+
+    def decode(self, data: RawData, changed: Optional[list[int]] = None) -> Iterator[tuple[str, SLValue]]:
+        """Decode the controls stored in the changed bytes (all controls if None)"""
+        ids: Iterable[int]
+        if changed is None:
+            ids = range(len(self.ctrls))
+        elif len(changed) == 1:
+            ids = self.index[changed[0]]
+        else:
+            ids = sorted({c for i in changed for c in self.index[i]})
+
+        for i in ids:
+            name, kind, b, arg = self.ctrls[i]
+            value: SLValue
+            if kind == self.NIBBLE_PAIR:
+                value = data[b] << 4 | data[b + 1]
+                if arg:
+                    value /= 255
+            elif kind == self.SHORT_INT:
+                value = data[b]
+            else:
+                value = 1 if data[b] & arg else 0
+            yield name, value
+
 
 @dataclass
 class RawBaseChannel:
     index: int
-    ctrls: dict[str, Union[SLNibblePair, SLBit, SLShortInt]]
+    ctrls: dict[str, RawCtrl]
     levels: int = 0
     _: KW_ONLY
-    read_id: list[int] = field(default_factory=list)
-    resp_id: list[int] = field(default_factory=list)
-    write_id: list[int] = field(default_factory=list)
+    read_id: bytes = b""
+    resp_id: bytes = b""
+    write_id: bytes = b""
     length: int = 0          # raw data length
     offset: int = 0          # raw data offset in SysEx message (offset 0 = 0xF0)
+    decoder: RawDecoder = field(init=False, repr=False, compare=False)
 
     def __post_init__(self) -> None:
-        self.read_id[:] = [i if i != C_INDEX else self.index for i in self.read_id]
-        self.resp_id[:] = [i if i != C_INDEX else self.index for i in self.resp_id]
-        self.write_id[:] = [i if i != C_INDEX else self.index for i in self.write_id]
+        # Resolve C_INDEX and keep the IDs as bytes, ready to be compared with / prepended to raw buffers
+        self.read_id = bytes(i if i != C_INDEX else self.index for i in self.read_id)
+        self.resp_id = bytes(i if i != C_INDEX else self.index for i in self.resp_id)
+        self.write_id = bytes(i if i != C_INDEX else self.index for i in self.write_id)
+        self.decoder = RawDecoder.compile(self.ctrls, self.offset, self.length)
 
 
 @dataclass
 class RawInputChannel(RawBaseChannel):
-    read_id: list[int] = dfl([0x6b, C_INDEX])
-    resp_id: list[int] = dfl([0x6b, C_INDEX])
-    write_id: list[int] = dfl([0x6a, C_INDEX])
+    read_id: bytes = dfl([0x6b, C_INDEX])
+    resp_id: bytes = dfl([0x6b, C_INDEX])
+    write_id: bytes = dfl([0x6a, C_INDEX])
     length: int = dfi(120)
     offset: int = dfi(3)
 
 
 @dataclass
 class RawGeq(RawBaseChannel):
-    read_id: list[int] = dfl([0x6d, 0x01, C_INDEX])
-    resp_id: list[int] = dfl([0x6c, 0x01, C_INDEX])
-    write_id: list[int] = dfl([0x6c, 0x01, C_INDEX])
+    read_id: bytes = dfl([0x6d, 0x01, C_INDEX])
+    resp_id: bytes = dfl([0x6c, 0x01, C_INDEX])
+    write_id: bytes = dfl([0x6c, 0x01, C_INDEX])
     length: int = dfi(64)
     offset: int = dfi(4)
 
 
 @dataclass
 class RawFx(RawBaseChannel):
-    read_id: list[int] = dfl([0x6d, 0x03, C_INDEX])
-    resp_id: list[int] = dfl([0x6c, 0x03, C_INDEX])
-    write_id: list[int] = dfl([0x6c, 0x03, C_INDEX])
+    read_id: bytes = dfl([0x6d, 0x03, C_INDEX])
+    resp_id: bytes = dfl([0x6c, 0x03, C_INDEX])
+    write_id: bytes = dfl([0x6c, 0x03, C_INDEX])
     length: int = dfi(15)
     offset: int = dfi(4)
 
 
 @dataclass
 class RawMidiConfig(RawBaseChannel):
-    read_id: list[int] = dfl([0x54])
-    resp_id: list[int] = dfl([0x54])
-    write_id: list[int] = dfl([0x53])
+    read_id: bytes = dfl([0x54])
+    resp_id: bytes = dfl([0x54])
+    write_id: bytes = dfl([0x53])
     length: int = dfi(25)
     offset: int = dfi(2)
 
 
 @dataclass
 class RawStatus(RawBaseChannel):
-    read_id: list[int] = dfl([0x38, 0x03]) # RD REQ ID bytes
-    resp_id: list[int] = dfl([0x39, 0x03]) # Expected response ID bytes
+    read_id: bytes = dfl([0x38, 0x03]) # RD REQ ID bytes
+    resp_id: bytes = dfl([0x39, 0x03]) # Expected response ID bytes
     length: int = dfi(41) # Expected response length, without F0,F7 and ID bytes
     offset: int = dfi(3)
 
 
 @dataclass
 class RawFaders(RawBaseChannel):
-    read_id: list[int] = dfl([0x6e])
-    resp_id: list[int] = dfl([0x6e])
+    read_id: bytes = dfl([0x6e])
+    resp_id: bytes = dfl([0x6e])
     length: int = dfi(41)
     offset: int = dfi(2)
 
 
 @dataclass
 class RawMasters(RawBaseChannel):
-    read_id: list[int] = dfl([0x60])
-    resp_id: list[int] = dfl([0x60])
-    write_id: list[int] = dfl([0x6f])
+    read_id: bytes = dfl([0x60])
+    resp_id: bytes = dfl([0x60])
+    write_id: bytes = dfl([0x6f])
     length: int = dfi(57)
     offset: int = dfi(2)
 
@@ -119,7 +208,7 @@ class RawMasters(RawBaseChannel):
 @dataclass
 class RawChannel(SLChannel):
     info: RawBaseChannel
-    raw: list[int] = field(default_factory=list)
+    raw: bytearray = field(default_factory=bytearray)
 
 
 @dataclass
@@ -1,22 +1,36 @@
 import sys
 import threading
 import time
-import raw1394
-import mido
+import collections
 
-from typing import Optional
+from contextlib import contextmanager
+from typing import Optional, Iterator, Callable, TYPE_CHECKING
 
+from ..metrics import registry
 from .backend import SLBackend, SLChannel, SLType, SLTypeGain, SLTypeFloat, SLValue
 from .raw import RawBaseChannel, RawInputChannel, RawFaders, RawStatus
 
-from .raw import RawChannel, RawStudioLiveDevice, SLNibblePair, SLBit, SLShortInt
+from .raw import RawChannel, RawStudioLiveDevice, RawData, SLNibblePair, SLBit, SLShortInt
+from .trace import TX, RX
 
+if TYPE_CHECKING:
+    import mido
 
-def h(data: list[int]) -> str:
+
+_transceive_time = registry.histogram("studiolive_transceive_seconds", "Adapter write and read of one SysEx transaction")
+_lock_wait = registry.histogram("studiolive_lock_wait_seconds", "Wait for the adapter lock before a transaction")
+_status_poll = registry.histogram("studiolive_status_poll_seconds", "Status block read and decode")
+_fw_retries = registry.counter("studiolive_fw_retries_total", "FireWire reads repeated while the mixer is busy (0xfe)")
+_fw_errors = registry.counter("studiolive_fw_errors_total", "FireWire reads failed after the retries")
+_midi_dropped = registry.counter("studiolive_midi_dropped_total", "MIDI SysEx frames dropped by the full input queue")
+_reconnects = registry.counter("studiolive_reconnects_total", "Mixer connections re-established after an error")
+
+
+def h(data: RawData) -> str:
     return " ".join([f"{x:02x}" for x in data])
 
 
-def _decode_raw(data: list[int], n: int) -> int:
+def _decode_raw(data: bytes, n: int) -> int:
     a6 = data[n*3+0]
     b6 = data[n*3+1]
     ca = (data[n*3+2] >> 0) & 0x3
@@ -24,7 +38,16 @@ def _decode_raw(data: list[int], n: int) -> int:
     return (a6 << 0) | (b6 << 8) | (ca << 6) | (cb << 6 + 8)
 
 
-def _val_from_nibble_pair(data: list[int], dataType: type[SLType]) -> float:
+def decode_raw_dump(data: bytes) -> list[int]:
+    "Bytes carried by a raw memory dump frame (0x2e 0x40 or 0x2e 0x20)"
+    rawdump = []
+    for n in [_decode_raw(data, n) for n in range((len(data)-4)//3)]:
+        rawdump.append((n >> 0) & 0xFF)
+        rawdump.append((n >> 8) & 0xFF)
+    return rawdump
+
+
+def _val_from_nibble_pair(data: RawData, dataType: type[SLType]) -> float:
     value: float
     value = (data[0] << 4 | data[1])
     if dataType in [SLTypeFloat, SLTypeGain]:
@@ -33,29 +56,34 @@ def _val_from_nibble_pair(data: list[int], dataType: type[SLType]) -> float:
     return value
 
 
-def _val_to_nibble_pair(value: float, dataType: type[SLType]) -> list[int]:
+def _val_to_nibble_pair(value: float, dataType: type[SLType]) -> bytes:
     if dataType in [SLTypeFloat, SLTypeGain]:
         value = value * 255
     value = max(0, min(255, int(value)))
-    return [(value >> 4) & 0x0F, (value >> 0) & 0x0F]
+    return bytes(((value >> 4) & 0x0F, (value >> 0) & 0x0F))
 
 
-def _set_bit_val(data: list[int], byte: int, bit: int, val: bool) -> None:
+def _set_bit_val(data: bytearray, byte: int, bit: int, val: bool) -> None:
     if val:
         data[byte] |= (1 << bit)
     else:
         data[byte] &= (1 << bit) ^ 0xff
 
 
-def _get_bit_val(data: list[int], byte: int, bit: int) -> int:
+def _get_bit_val(data: bytes, byte: int, bit: int) -> int:
     return 1 if data[byte] & (1 << bit) else 0
 
 
 class AbstractAdapter():
-    def write(self, wd: list[int]) -> None:
+    """Transport of SysEx frames
+
+    Reads return a view of the received frame; it is only valid
+    until the next read on the adapter.
+    """
+    def write(self, wd: bytes) -> None:
         raise NotImplementedError
 
-    def read(self, num_bytes: int) -> list[int]:
+    def read(self, num_bytes: int) -> memoryview:
         raise NotImplementedError
 
 
@@ -64,7 +92,9 @@ class PortNotFoundError(SystemError):
 
 
 class MidiAdapter(AbstractAdapter):
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, queue_size: int = 256) -> None:
+        import mido
+
         self._portout: mido.ports.BaseOutput
         self._portin: mido.ports.BaseInput
         self._port_name = name
@@ -86,40 +116,45 @@ class MidiAdapter(AbstractAdapter):
         self._portout = mido.open_output(self._output_port_name, client_name=self._client_name, virtual=self._virtual, api=api)
         self._portin = mido.open_input(self._input_port_name, client_name=self._client_name, virtual=self._virtual, api=api)
 
-        self._in_buffer: list[int] = []
+        # Complete SysEx frames pushed by the input callback, oldest dropped when the reader falls behind
+        self._in_frames: collections.deque[bytes] = collections.deque(maxlen=queue_size)
+        self._in_cond = threading.Condition()
+        self.dropped = 0
         self._portin.callback = self._input_callback
 
-        self.write([0xf0, 0x33, 0xf7])
+        self.write(b"\xf0\x33\xf7")
         self._read(10)
 
-    def write(self, data: list[int]) -> None:
+    def write(self, data: bytes) -> None:
         if not self._passive:
+            import mido
             msg = mido.Message.from_bytes(bytes(data))
             self._portout.send(msg)
 
-    def read(self, num_bytes: int) -> list[int]:
+    def read(self, num_bytes: int) -> memoryview:
         return self._read()
 
-    def _read(self, timeout: float = 2) -> list[int]:
-        tm = time.time() + timeout
-
-        while 0xf7 not in self._in_buffer:
-            if time.time() > tm:
+    def _read(self, timeout: float = 2) -> memoryview:
+        with self._in_cond:
+            if not self._in_cond.wait_for(lambda: self._in_frames, min(timeout, threading.TIMEOUT_MAX)):
                 raise SystemError()
-            time.sleep(0.01)
+            return memoryview(self._in_frames.popleft())
 
-        pos = self._in_buffer.index(0xf7)
-        b = self._in_buffer[:pos + 1]
-        self._in_buffer[:pos + 1] = []
-        return list(b)
-
-    def _input_callback(self, msg: mido.Message) -> None:
+    def _input_callback(self, msg: "mido.Message") -> None:
         if msg.type == 'sysex':
-            self._in_buffer += [0xf0] + list(msg.data[:]) + [0xf7]
+            frame = bytes(msg.bin())
+            with self._in_cond:
+                if len(self._in_frames) == self._in_frames.maxlen:
+                    self.dropped += 1
+                    _midi_dropped.inc()
+                self._in_frames.append(frame)
+                self._in_cond.notify()
 
 
 class Raw1394Adapter(AbstractAdapter):
     def __init__(self) -> None:
+        import raw1394
+
         self._handle = raw1394.Raw1394()
 
         # Clean internal data register (from previous communication)
@@ -127,101 +162,140 @@ class Raw1394Adapter(AbstractAdapter):
         while self._recv_msg(0x01, True)[0] != 0xfe and retries < 100:
             retries += 1
 
-    def write(self, wd: list[int]) -> None:
+    def write(self, wd: bytes) -> None:
         if len(wd) % 4:
-            wd += [0xf7] * (4 - len(wd) % 4)
+            wd = bytes(wd) + b"\xf7" * (4 - len(wd) % 4)
         wa = 0xFFFFe0f00408
+        # pyraw1394 takes a bytearray (as before the bytes buffers)
         self._handle.write(wa, bytearray(wd))
 
-    def read(self, num_bytes: int) -> list[int]:
+    def read(self, num_bytes: int) -> memoryview:
         return self._recv_msg(num_bytes)
 
-    def _recv_msg(self, read_bytes: int, allow_fail: bool = False) -> list[int]:
+    def _recv_msg(self, read_bytes: int, allow_fail: bool = False) -> memoryview:
         aligned_bytes = int((read_bytes + 3) / 4) * 4
         i = 0
         ra = 0xFFFFe0f0091c
-        rd = list(self._handle.read(ra, aligned_bytes))
+        rd = memoryview(self._handle.read(ra, aligned_bytes))
         while rd[0] == 0xfe and not allow_fail and i < 20:
-            rd = list(self._handle.read(ra, aligned_bytes))
+            rd = memoryview(self._handle.read(ra, aligned_bytes))
             i += 1
             time.sleep(0.002 if i < 8 else 0.1)
+        if i:
+            _fw_retries.inc(i)
         if i > 15:
+            _fw_errors.inc()
             raise Exception("recv_msg - transfer error: 0xFE in the first byte (%d times)" % i)
         return rd
 
 
 class SLRawBackend(SLBackend):
-    def __init__(self, device: type[RawStudioLiveDevice], midi: Optional[str] = None) -> None:
+    def __init__(self, device: type[RawStudioLiveDevice], midi: Optional[str] = None, write_window: float = 0.02,
+                 poll_rate: float = 30, idle_poll_rate: float = 2,
+                 adapter: Optional[Callable[[], AbstractAdapter]] = None) -> None:
         super().__init__()
         self.device = device
         self._allchannels = {n: RawChannel(n, {n: 0 for n in i.ctrls.keys()}, i) for n, i in self.device.channels.items()}
         self.channels = {k: v for k, v in self._allchannels.items() if not k.startswith("_")}
 
         self._midi = midi
+        self._adapter_factory = adapter
 
         self.lock = threading.Lock()
         self._adapter: Optional[AbstractAdapter] = None
 
+        # Write coalescing: channels modified by set_control, written by the writer thread
+        self.write_window = write_window
+        self._write_cond = threading.Condition()
+        self._write_thread: Optional[threading.Thread] = None
+        self._dirty: dict[str, RawChannel] = {}
+        self._dirty_since = 0.0
+        self._writing: set[str] = set()         # channels taken by the writer, not yet written
+        self._patches: dict[str, int] = {}      # set_control count per channel, detects writes during a re-read
+        self._batches: dict[int, set[str]] = {}  # channels held back by the open batch of each thread
+
+        # Status polling: modified channels are queued and re-read in the spare time of each tick.
+        # Poll rate is high with clients connected or controls moving, low when idle.
+        self.poll_rate = poll_rate
+        self.idle_poll_rate = idle_poll_rate
+        self.activity_hold = 2.0
+        self.status_interval = 1 / poll_rate
+        self.status_rate = 0.0
+        self._last_status = 0.0
+        self._read_time = 0.0
+        self._refresh: dict[str, None] = {}
+
         self.sel_channel = -1
 
-    def _transceive_msg(self, write_data: list[int], read_bytes: int) -> list[int]:
+        registry.gauge("studiolive_status_poll_rate", lambda: self.status_rate, "Mixer status polls per second")
+        registry.gauge("studiolive_refresh_backlog", lambda: self.refresh_backlog, "Modified channels waiting for re-read")
+
+    def _transceive_msg(self, write_data: bytes, read_bytes: int) -> memoryview:
         assert len(write_data) > 0
 
+        start = time.monotonic()
         self.lock.acquire()
-        data: list[int] = []
+        locked = time.monotonic()
+        _lock_wait.observe(locked - start)
+        data = memoryview(b"")
 
         try:
             if self._adapter is None:
                 raise SystemError("No raw1394, maybe StudioLive unexpectedly disconected?")
             self._adapter.write(write_data)
+            if self.trace:
+                self.trace.frame(TX, write_data)
             if read_bytes > 0:
                 data = self._adapter.read(read_bytes)
+                if self.trace:
+                    self.trace.frame(RX, data)
         finally:
             self.lock.release()
+            _transceive_time.observe(time.monotonic() - locked)
 
         return data
 
-    def _read_data(self, cmd: list[int], length: int, status: list[int]) -> list[int]:
-        cmd = [0xf0] + cmd + [0xf7]
+    def _read_data(self, cmd: bytes, length: int, status: bytes) -> memoryview:
+        cmd = b"\xf0" + cmd + b"\xf7"
         length += 2
         data = self._transceive_msg(cmd, (length + 2))
-        assert data[1:len(status) + 1] == status, f"StudioLive: unexpected status for cmd {cmd} expected {status}, got {data[1:len(status) + 1]}"
+        assert data[1:len(status) + 1] == status, f"StudioLive: unexpected status for cmd {h(cmd)} expected {h(status)}, got {h(data[1:len(status) + 1])}"
         #assert data[length + 1] == 0xf7, "StudioLive: no EOF byte for cmd %x, %x" % (cmd[1], data[length+1])
         #assert len(data) == (length + len(status))
         return data[1+len(status):len(status) + length-1]
 
-    def _write_data(self, cmd: list[int], status: Optional[int] = None) -> None:
-        cmd = [0xf0] + cmd + [0xf7]
+    def _write_data(self, cmd: bytes, status: Optional[int] = None) -> None:
+        cmd = b"\xf0" + cmd + b"\xf7"
         data = self._transceive_msg(cmd, 1)
         if status:
             assert data[1] == status, "StudioLive: unexpected status for cmd %x: expected %x, got %x" % (cmd[0], status, data[1])
         assert data[2] == 0xf7, "StudioLive: no EOF byte for cmd %x" % (cmd[1])
 
-    def _write_raw(self, cmd: list[int]) -> None:
-        cmd = [0xf0] + cmd + [0xf7]
+    def _write_raw(self, cmd: bytes) -> None:
+        cmd = b"\xf0" + cmd + b"\xf7"
         self._transceive_msg(cmd, 0) # FIXME: Check for ACK?
         time.sleep(0.1)
 
     def route_source_1516(self, main_mix: bool = False) -> None:
         if main_mix:
             # Route main mix output to FireWire stream 15/16
-            self._write_raw([0x52, 0x13, 0x0e, 0x02, 0x00, 0x00, 0x00])
+            self._write_raw(b"\x52\x13\x0e\x02\x00\x00\x00")
         else:
             # Route analog input 15/16 to FireWire stream 15/16
-            self._write_raw([0x52, 0x13, 0x0e, 0x00, 0x0e, 0x00, 0x00])
+            self._write_raw(b"\x52\x13\x0e\x00\x0e\x00\x00")
 
-    def _rd_channel(self, ch: RawBaseChannel) -> list[int]:
+    def _rd_channel(self, ch: RawBaseChannel) -> memoryview:
         assert ch.read_id
         assert ch.resp_id
         return self._read_data(ch.read_id, ch.length, ch.resp_id)
 
-    def _wr_channel(self, ch: RawChannel) -> None:
+    def _wr_channel(self, ch: RawChannel, raw: Optional[bytes] = None) -> None:
         assert isinstance(ch.info, RawBaseChannel)
         assert ch.info.write_id
 
-        self._write_data(ch.info.write_id + ch.raw + [0], 0x10)
+        self._write_data(ch.info.write_id + (ch.raw if raw is None else raw) + b"\0", 0x10)
 
-    def _update_levels_from_status(self, levels: list[int]) -> None:
+    def _update_levels_from_status(self, levels: memoryview) -> None:
         i = 0
 
         levels = levels[19:19 + 23]
@@ -240,7 +314,7 @@ class SLRawBackend(SLBackend):
                     i += 1
         super()._update_levels()
 
-    def _update_faders(self, data: list[int]) -> None:
+    def _update_faders(self, data: memoryview) -> None:
         for name, ch in self.channels.items():
             assert isinstance(ch, RawChannel)
             if isinstance(ch.info, RawInputChannel):
@@ -249,36 +323,34 @@ class SLRawBackend(SLBackend):
                 value = _val_from_nibble_pair(data[b * 2: b * 2 + 2], SLTypeGain)
                 self._update_control(ch, control, value)
 
-    def _update_channel(self, ch: RawChannel, data: list[int]) -> None:
+    def _update_channel(self, ch: RawChannel, data: memoryview) -> None:
         handled = False
 
         if len(data) != ch.info.length:
-            print("_update_channel data length mismatch:", type(ch.info), data, len(data), ch.info.length)
+            print("_update_channel data length mismatch:", type(ch.info), h(data), len(data), ch.info.length)
             return
 
         if isinstance(ch.info, RawFaders):
-            return self._update_faders(data)
+            if ch.raw != data:
+                ch.raw[:] = data
+                self._update_faders(data)
+            return
         elif isinstance(ch.info, RawStatus):
             self._update_levels_from_status(data)
 
-        for control, pos in ch.info.ctrls.items():
-            b = pos.byte - ch.info.offset
-            if isinstance(pos, SLNibblePair):
-                value = _val_from_nibble_pair(data[b:b + 2], pos.dataType)
-            elif isinstance(pos, SLShortInt):
-                value = data[b:b + 1][0]
-            elif isinstance(pos, SLBit):
-                value = _get_bit_val(data, b, pos.bit)
-            else:
-                print("StudioLive: Unknown control type")
+        # Unchanged block: nothing to decode
+        changed = ch.info.decoder.diff(ch.raw, data)
+        if changed == []:
+            return
 
+        for control, value in ch.info.decoder.decode(data, changed):
             if self._update_control(ch, control, value):
                 handled = True
 
-        for i in range(len(data)):
-            if self.debug and ch.raw and ch.raw[i] != data[i] and not handled:
-                print("StudioLive: Channel %s change: byte %d, oldval = %x, newval = %x" % (ch.name, i, ch.raw[i], data[i]))
-        ch.raw = data
+        if self.trace and changed and not handled:
+            self.trace.unhandled(ch.name, changed)
+        # Copy into the channel's own buffer, the view is only valid until the next adapter read
+        ch.raw[:] = data
 
     def _readonly_update(self) -> None:
         channels: dict[str, RawChannel] = {k: v for k, v in self._allchannels.items() if isinstance(v, RawChannel)}
@@ -288,8 +360,8 @@ class SLRawBackend(SLBackend):
             data = self._adapter._read(1e12)
             size = len(data)
             assert data[size - 1] == 0xf7, "StudioLive: no EOF byte"
-
-            echo = True
+            if self.trace:
+                self.trace.frame(RX, data)
 
             match = False
             for name, ch in channels.items():
@@ -304,13 +376,6 @@ class SLRawBackend(SLBackend):
 
                 if match:
                     raw = data[:-1][ch.info.offset:ch.info.offset + ch.info.length]
-
-                    if isinstance(ch.info, RawStatus):
-                        echo = False
-
-                    if echo:
-                        print(type(ch.info), f"{len(data)}/{len(raw)}:", h(data[:ch.info.offset]), ">", h(raw), "<", h(data[ch.info.offset + len(raw):]))
-
                     if len(raw):
                         self._update_channel(ch, raw)
                     break
@@ -323,59 +388,172 @@ class SLRawBackend(SLBackend):
             return
 
         ch_status = self._allchannels["_status"]
+        next_tick = time.monotonic()
         while not self._stop_event.is_set():
             try:
+                now = time.monotonic()
                 status = self._rd_channel(ch_status.info)
                 self._update_channel(ch_status, status)
+                _status_poll.observe(time.monotonic() - now)
+                self._update_status_rate(now)
 
                 for mod_ctrl, ch_name in self.device.status_modified.items():
                     if ch_status.ctrls[mod_ctrl]:
-                        ch = self._allchannels[ch_name]
-                        self._update_channel(ch, self._rd_channel(ch.info))
+                        self._refresh[ch_name] = None
+
+                # Keep the status cadence, re-read modified channels in the remaining time of the tick
+                self.status_interval = self._poll_interval()
+                next_tick = max(next_tick + self.status_interval, time.monotonic())
+                self._refresh_channels(next_tick)
 
-                time.sleep(0.1)
+                self._stop_event.wait(next_tick - time.monotonic())
 
             except SystemError as e:
                 self._adapter = None
                 print("SystemError, trying connect_hw:", e)
+                if self.trace:
+                    self.trace.note("SystemError: %s" % e)
                 self.connect_hw()
+                _reconnects.inc()
+                next_tick = time.monotonic()
+
+    def _poll_interval(self) -> float:
+        # Any client connected (with or without meters) or controls moving: console changes reach clients quickly
+        listener = self.listener
+        active = listener.level_callbacks or listener.update_callbacks or time.monotonic() - self.last_change < self.activity_hold
+        return 1 / (self.poll_rate if active else self.idle_poll_rate)
+
+    def _update_status_rate(self, now: float) -> None:
+        if self._last_status:
+            rate = 1 / max(now - self._last_status, 1e-6)
+            self.status_rate = self.status_rate * 0.9 + rate * 0.1 if self.status_rate else rate
+        self._last_status = now
+
+    def _refresh_channels(self, deadline: float) -> None:
+        "Re-read queued channels until the deadline, at least one channel per call"
+        first = True
+        skipped = []
+        while self._refresh and (first or time.monotonic() + self._read_time < deadline):
+            ch_name = next(iter(self._refresh))
+            del self._refresh[ch_name]
+
+            ch = self._allchannels[ch_name]
+            with self._write_cond:
+                # Channel waiting for write (or being written) would be reverted by the older data,
+                # read it after the write: the console may have changed it too
+                if ch_name in self._dirty or ch_name in self._writing:
+                    skipped.append(ch_name)
+                    continue
+                patches = self._patches.get(ch_name, 0)
+
+            start = time.monotonic()
+            data = self._rd_channel(ch.info)
+            with self._write_cond:
+                # Client wrote to the channel during the read: ch.raw is newer than the data, read again later
+                if self._patches.get(ch_name, 0) != patches:
+                    skipped.append(ch_name)
+                else:
+                    self._update_channel(ch, data)
+            self._read_time = self._read_time * 0.8 + (time.monotonic() - start) * 0.2
+            first = False
+
+        for ch_name in skipped:
+            self._refresh[ch_name] = None
 
-    def _check_for_raw(self, data: list[int]) -> bool:
-        if data[1:3] == [0x2e, 0x40] or data[1:3] == [0x2e, 0x20]:
-            rawdump = []
-            rd = [_decode_raw(data, n) for n in range((len(data)-4)//3)]
-            for n in rd:
-                rawdump.append((n >> 0) & 0xFF)
-                rawdump.append((n >> 8) & 0xFF)
-            print("RD", "".join([f"{x:02x}" for x in rawdump]))
-            if True:
-                print("RC", " ".join([chr(n) if (
-                    n >= ord('a') and n <= ord('z') or
-                    n >= ord('A') and n <= ord('Z') or
-                    n >= ord('0') and n <= ord('9') or
-                    False
-                ) else "_" for n in rawdump]))
-            return True
-        return False
+    @property
+    def refresh_backlog(self) -> int:
+        "Number of modified channels waiting for re-read"
+        return len(self._refresh)
+
+    def _check_for_raw(self, data: memoryview) -> bool:
+        "Raw memory dump frame, decoded offline from the trace by tools/tracedump.py"
+        return data[1:3] == b"\x2e\x40" or data[1:3] == b"\x2e\x20"
 
     def set_control(self, ch: SLChannel, control: str, value: SLValue) -> None:
         assert isinstance(ch, RawChannel)
         pos = ch.info.ctrls[control]
         b = pos.byte - ch.info.offset
-        if isinstance(pos, SLNibblePair):
-            ch.raw[b:b + 2] = _val_to_nibble_pair(value, pos.dataType)
-        elif isinstance(pos, SLShortInt):
-            ch.raw[b:b + 1] = [int(value)]
-        elif isinstance(pos, SLBit):
-            _set_bit_val(ch.raw, b, pos.bit, value >= 0.5)
-        else:
-            print("StudioLive: Unknown control type")
+        with self._write_cond:
+            if isinstance(pos, SLNibblePair):
+                ch.raw[b:b + 2] = _val_to_nibble_pair(value, pos.dataType)
+            elif isinstance(pos, SLShortInt):
+                ch.raw[b] = int(value)
+            elif isinstance(pos, SLBit):
+                _set_bit_val(ch.raw, b, pos.bit, value >= 0.5)
+            else:
+                print("StudioLive: Unknown control type")
 
+            self.last_change = time.monotonic()
+            if not self._dirty:
+                self._dirty_since = self.last_change
+            self._dirty[ch.name] = ch
+            self._patches[ch.name] = self._patches.get(ch.name, 0) + 1
+            held = self._batches.get(threading.get_ident())
+            if held is not None:
+                held.add(ch.name)
+            self._write_cond.notify()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        "Hold the channels modified by this thread until the (outermost) batch ends, other threads write as usual"
+        ident = threading.get_ident()
+        with self._write_cond:
+            outer = ident not in self._batches
+            if outer:
+                self._batches[ident] = set()
         try:
-            self._wr_channel(ch)
-        except SystemError:
-            print("Device not responding, client request unsuccessfull.")
-            #time.sleep(5)
+            yield
+        finally:
+            if outer:
+                with self._write_cond:
+                    del self._batches[ident]
+                    # Don't wait for the rest of the write window
+                    self._dirty_since = 0
+                    self._write_cond.notify()
+
+    def _ready_writes(self) -> list[str]:
+        "Dirty channels not held by an open batch"
+        held = set().union(*self._batches.values())
+        return [name for name in self._dirty if name not in held]
+
+    def _write_process(self) -> None:
+        """Write each modified channel block once per write window
+
+        Controls changed within the window are coalesced into one transaction
+        per channel, with the latest values.
+        """
+        while True:
+            with self._write_cond:
+                while True:
+                    stop = self._stop_event.is_set()
+                    ready = list(self._dirty) if stop else self._ready_writes()
+                    delay = self._dirty_since + self.write_window - time.monotonic()
+                    if stop or (ready and delay <= 0):
+                        break
+                    self._write_cond.wait(delay if ready else 0.5)
+
+                writes = [(self._dirty[name], bytes(self._dirty[name].raw)) for name in ready]
+                self._writing = set(ready)
+                for name in ready:
+                    del self._dirty[name]
+                if self._dirty:
+                    # Held by a batch, which flushes them at its end
+                    self._dirty_since = time.monotonic()
+
+            for ch, raw in writes:
+                # Any failure drops just this write, the thread serves all later ones
+                try:
+                    self._wr_channel(ch, raw)
+                except Exception as e:
+                    print("Device not responding, client request unsuccessfull:", e)
+                    if self.trace:
+                        self.trace.note("Write of %s failed: %s" % (ch.name, e))
+                finally:
+                    with self._write_cond:
+                        self._writing.discard(ch.name)
+
+            if stop:
+                break
 
     def connect(self) -> None:
         SLBackend.connect(self)
@@ -389,11 +567,23 @@ class SLRawBackend(SLBackend):
         self.update_thread = threading.Thread(target=self._update_process)
         self.update_thread.start()
 
+        self._write_thread = threading.Thread(target=self._write_process)
+        self._write_thread.start()
+
+    def disconnect(self) -> None:
+        super().disconnect()
+        with self._write_cond:
+            self._write_cond.notify()
+        if self._write_thread:
+            self._write_thread.join()
+
     def connect_hw(self, wait: bool = True) -> None:
         self._adapter = None
         while not self._adapter:
             try:
-                if self._midi:
+                if self._adapter_factory:
+                    self._adapter = self._adapter_factory()
+                elif self._midi:
                     self._adapter = MidiAdapter(self._midi)
                 else:
                     self._adapter = Raw1394Adapter()
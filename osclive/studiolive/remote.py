@@ -1,4 +1,8 @@
+from typing import ContextManager
+
 from .backend import SLBackend, SLListener, SLUpdateCallback, SLLevelCallback, SLValue
+from .backend import SLChannel
+from .trace import CONTROL_OUT
 
 
 class SLRemote(SLListener):
@@ -25,6 +29,20 @@ class SLRemote(SLListener):
     def remove_update_callback(self, callback: SLUpdateCallback) -> None:
         self.update_callbacks.remove(callback)
 
+    @property
+    def level_seq(self) -> int:
+        "Incremented on every level update"
+        return self.backend.level_seq
+
+    @property
+    def state_seq(self) -> int:
+        "Incremented on every control change, versions the snapshot()"
+        return self.backend.state_seq
+
+    def snapshot(self) -> dict[str, SLChannel]:
+        "Copy of the current state of all channels"
+        return {n: SLChannel(n, dict(ch.ctrls), level=ch.level) for n, ch in self.channels.items()}
+
     def get_level(self, channel: str, stereo: bool = False) -> int | tuple[int, int]:
         assert channel in self.channels
         level = self.channels[channel].level
@@ -54,9 +72,19 @@ class SLRemote(SLListener):
 
         value = max(min(value, 1), 0)
 
+        if self.backend.trace:
+            self.backend.trace.control(CONTROL_OUT, ch.name, control, value)
+
+        # Backend first: it records the pending write, so a concurrent re-read
+        # of the channel can't revert the value echoed below
+        self.backend.set_control(ch, control, value)
+
         ch.ctrls[control] = value
+        self.backend.state_seq += 1
 
         for callback in self.update_callbacks:
             callback(ch.name, control, value)
 
-        self.backend.set_control(ch, control, value)
+    def batch(self) -> ContextManager[None]:
+        "Group multiple set_control calls into one backend transaction"
+        return self.backend.batch()
@@ -0,0 +1,99 @@
+import itertools
+import struct
+import time
+
+from typing import Iterator, Optional
+
+
+TRACE_MAGIC = b"SLTRACE1"
+
+# Record kinds
+TX, RX, CONTROL_IN, CONTROL_OUT, UNHANDLED, NOTE = range(1, 7)
+KIND_NAMES = {TX: "tx", RX: "rx", CONTROL_IN: "ctl<", CONTROL_OUT: "ctl>", UNHANDLED: "unhandled", NOTE: "note"}
+
+# Sequence number (0 = empty slot), wall clock time, kind, original and stored payload length
+_record = struct.Struct("<QdBxHH")
+_value = struct.Struct("<d")
+
+
+class TraceBuffer:
+    """Fixed size ring of timestamped binary records: SysEx frames and control events
+
+    Each record takes one slot, payloads longer than the slot are truncated.
+    Writers don't lock: the slot is taken from an atomic counter and the bytes
+    are copied as they are, no formatting. Callers check the backend's trace
+    attribute for None first, so the disabled trace costs one attribute test.
+    """
+    def __init__(self, slots: int = 4096, slot_size: int = 256, path: Optional[str] = None) -> None:
+        assert slot_size > _record.size
+        self.slots = slots
+        self.slot_size = slot_size
+        self.payload_size = slot_size - _record.size
+        self.path = path
+        self._buf = bytearray(slots * slot_size)
+        self._seq = itertools.count(1)
+
+    def record(self, kind: int, data: bytes | memoryview) -> None:
+        seq = next(self._seq)
+        pos = ((seq - 1) % self.slots) * self.slot_size
+        n = min(len(data), self.payload_size)
+        _record.pack_into(self._buf, pos, seq, time.time(), kind, len(data), n)
+        pos += _record.size
+        self._buf[pos:pos + n] = data[:n]
+
+    def frame(self, kind: int, data: bytes | memoryview) -> None:
+        "SysEx frame sent (TX) to or received (RX) from the mixer"
+        self.record(kind, data)
+
+    def control(self, kind: int, channel: str, control: str, value: float) -> None:
+        "Control change from the mixer (CONTROL_IN) or from a client (CONTROL_OUT)"
+        self.record(kind, _value.pack(value) + ("%s/%s" % (channel, control)).encode())
+
+    def unhandled(self, channel: str, changed: list[int]) -> None:
+        "Changed bytes of a block not decoded to any control"
+        self.record(UNHANDLED, channel.encode() + b"\0" + bytes(min(i, 255) for i in changed))
+
+    def note(self, text: str) -> None:
+        self.record(NOTE, text.encode())
+
+    def records(self) -> Iterator[tuple[int, float, int, int, bytes]]:
+        "Stored records, oldest first: (seq, time, kind, original length, payload)"
+        buf = bytes(self._buf)
+        slots = []
+        for pos in range(0, len(buf), self.slot_size):
+            seq, t, kind, length, n = _record.unpack_from(buf, pos)
+            if seq:
+                slots.append((seq, t, kind, length, buf[pos + _record.size:pos + _record.size + n]))
+        return iter(sorted(slots))
+
+    def dump(self, path: Optional[str] = None) -> str:
+        "Write the records to a file readable by tools/tracedump.py"
+        path = path or self.path or time.strftime("osclive-trace-%Y%m%d-%H%M%S.bin")
+        count = 0
+        with open(path, "wb") as f:
+            f.write(TRACE_MAGIC)
+            for seq, t, kind, length, payload in self.records():
+                f.write(_record.pack(seq, t, kind, length, len(payload)) + payload)
+                count += 1
+        print("StudioLive: trace of %d records written to %s" % (count, path))
+        return path
+
+
+def read_trace(path: str) -> Iterator[tuple[int, float, int, int, bytes]]:
+    "Records of a dumped trace: (seq, time, kind, original length, payload)"
+    with open(path, "rb") as f:
+        assert f.read(len(TRACE_MAGIC)) == TRACE_MAGIC, "Not an osclive trace file: %s" % path
+        while header := f.read(_record.size):
+            seq, t, kind, length, n = _record.unpack(header)
+            yield seq, t, kind, length, f.read(n)
+
+
+def decode_control(payload: bytes) -> tuple[str, str, float]:
+    value, = _value.unpack_from(payload)
+    channel, _, control = payload[_value.size:].decode().partition("/")
+    return channel, control, value
+
+
+def decode_unhandled(payload: bytes) -> tuple[str, list[int]]:
+    channel, _, changed = payload.partition(b"\0")
+    return channel.decode(), list(changed)
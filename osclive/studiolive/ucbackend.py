@@ -1,10 +1,13 @@
+import collections
 import time
 import threading
 import struct
-from typing import Optional
+from contextlib import contextmanager
+from typing import Optional, Iterator
 
-from socket import socket, AF_INET, SOCK_STREAM
+from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY
 
+from ..metrics import registry
 from .backend import SLBackend, SLChannel, SLValue
 from .uc import UCChannel, UCStudioLiveDevice
 
@@ -16,6 +19,63 @@ def SLparsestr(s: bytes, n: Optional[int] = None) -> str:
     return (s[:s.find(b'\x00')]).decode()
 
 
+UC_SIGNATURE = 0xaa550011
+
+_frame = struct.Struct("II")
+_header = struct.Struct("IIHH")
+_channel_name = struct.Struct("HH48s")
+_control = struct.Struct("=Hd32s")
+
+_send_time = registry.histogram("studiolive_uc_send_seconds", "Send of control frames to Universal Control")
+_lock_wait = registry.histogram("studiolive_uc_lock_wait_seconds", "Wait for the connection lock before a send")
+
+
+class UCFrameReader:
+    """Buffered reader of UC frames
+
+    Receives into a reusable buffer, possibly several frames per syscall.
+    Frames are handed out as memoryviews valid until the next call of frames().
+    """
+    def __init__(self, connection: socket, size: int = 65536) -> None:
+        self.connection = connection
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def frames(self) -> Iterator[memoryview]:
+        """Receive once and yield all complete frames"""
+        if self._start:
+            # Move the incomplete frame to the beginning of the buffer
+            size = self._end - self._start
+            self._buf[:size] = self._buf[self._start:self._end]
+            self._start, self._end = 0, size
+
+        n = self.connection.recv_into(self._view[self._end:])
+        if not n:
+            raise ConnectionError("UC connection closed")
+        self._end += n
+
+        while self._end - self._start >= _frame.size:
+            signature, size = _frame.unpack_from(self._buf, self._start)
+            assert signature == UC_SIGNATURE
+            start = self._start + _frame.size
+            if self._end < start + size:
+                if _frame.size + size > len(self._buf):
+                    self._grow(_frame.size + size)
+                break
+
+            self._start = start + size
+            yield self._view[start:self._start]
+
+    def _grow(self, size: int) -> None:
+        # Views of the old buffer may still be held by the caller, don't resize it in place
+        buf = bytearray(max(size, len(self._buf) * 2))
+        buf[:self._end - self._start] = self._buf[self._start:self._end]
+        self._buf, self._view = buf, memoryview(buf)
+        self._start, self._end = 0, self._end - self._start
+
+
 # UniversalControl backend: based on https://github.com/jeffkaufman/vsl1818
 class SLUcBackend(SLBackend):
     def __init__(self, device: type[UCStudioLiveDevice], host: str, port: Optional[int] = None, name: str = "SL-Remote", ident: str = "1BE8DC6BF62EA577B") -> None:
@@ -35,34 +95,100 @@ class SLUcBackend(SLBackend):
 
         self._connect_event = threading.Event()
         self.connection: Optional[socket] = None
+        self._reader: Optional[UCFrameReader] = None
+
+        # Control writes: queued by set_control, latest value per (channel, control id), sent by the writer thread
+        self._send_lock = threading.Lock()
+        self._write_cond = threading.Condition()
+        self._write_thread: Optional[threading.Thread] = None
+        self._pending: dict[tuple[str, int], bytes] = {}
+        self._batches: dict[int, set[tuple[str, int]]] = {}     # controls held back by the open batch of each thread
+        self.writes = 0
+        self.coalesced = 0
+        self.rate_window = 1.0
+        self._write_log: collections.deque[tuple[float, int]] = collections.deque()   # (time, frames) of the recent writes
+
+        registry.gauge("studiolive_uc_writes", lambda: self.writes, "Control frames sent to Universal Control")
+        registry.gauge("studiolive_uc_coalesced", lambda: self.coalesced, "Control updates replaced by a newer value before sending")
+        registry.gauge("studiolive_uc_write_rate", lambda: self.write_rate, "Control frames sent per second")
 
         self._channel_int = {i.info.name: i for i in channels.values()}
         #self._control_rev: dict[str, dict[str, Control]]
         for ch in channels.values():
             ch.info._control_rev = {i: n for n, i in ch.info.ctrls.items()}
 
+        # Offsets of the channel levels in the category 5 frame
+        self._level_offsets: list[tuple[UCChannel, int, bool]] = []
+        i = 0
+        for ch in channels.values():
+            self._level_offsets.append((ch, i, ch.info.stereo))
+            i += 2 if ch.info.stereo else 1
+
     # Low-level send & receive functions
-    def recv(self, n: int) -> bytes:
-        if not self.connection:
-            return b""
-        s = b""
+    def readmsgs(self) -> Iterator[memoryview]:
+        assert self._reader
+        return self._reader.frames()
 
-        def remaining() -> int:
-            return n - len(s)
+    def sendmsg(self, message: bytes) -> None:
+        self._send(_frame.pack(UC_SIGNATURE, len(message)) + message)
 
-        while remaining() > 0:
-            s += self.connection.recv(remaining())
-        return s
+    def _send(self, data: bytes) -> None:
+        start = time.monotonic()
+        with self._send_lock:
+            locked = time.monotonic()
+            _lock_wait.observe(locked - start)
+            if not self.connection:
+                return
+            self.connection.sendall(data)
+        _send_time.observe(time.monotonic() - locked)
 
-    def readmsg(self) -> bytes:
-        signature, size = struct.unpack("II", self.recv(8))
-        assert signature == 0xaa550011
-        return self.recv(size)
+    def _write_process(self) -> None:
+        """Send all queued control frames in one write
 
-    def sendmsg(self, message: bytes) -> None:
-        if not self.connection:
-            return
-        self.connection.send(struct.pack("II", 0xaa550011, len(message)) + message)
+        Updates queued while the previous write is in progress are coalesced.
+        """
+        debug_next = time.monotonic() + 1
+        while True:
+            with self._write_cond:
+                while True:
+                    stop = self._stop_event.is_set()
+                    held = set().union(*self._batches.values()) if not stop else set()
+                    ready = [key for key in self._pending if key not in held]
+                    if stop or ready:
+                        break
+                    self._write_cond.wait(1)
+                frames = [self._pending.pop(key) for key in ready]
+
+            try:
+                if frames:
+                    self._send(b"".join(frames))
+            except OSError as e:
+                print("StudioLive: UC write failed:", e)
+
+            now = time.monotonic()
+            with self._write_cond:
+                self.writes += len(frames)
+                if frames:
+                    self._write_log.append((now, len(frames)))
+                    self._expire_write_log(now)
+
+            if stop:
+                break
+
+            if self.debug and frames and now >= debug_next:
+                debug_next = now + 1
+                print("StudioLive: UC writes %.1f/s, %d coalesced" % (self.write_rate, self.coalesced))
+
+    def _expire_write_log(self, now: float) -> None:
+        while self._write_log and self._write_log[0][0] <= now - self.rate_window:
+            self._write_log.popleft()
+
+    @property
+    def write_rate(self) -> float:
+        "Control frames sent per second over the last rate_window, drops to 0 once the writes stop"
+        with self._write_cond:
+            self._expire_write_log(time.monotonic())
+            return sum(n for t, n in self._write_log) / self.rate_window
 
     # Main functions
     def connect(self) -> None:
@@ -72,38 +198,46 @@ class SLUcBackend(SLBackend):
         self.connection = socket(AF_INET, SOCK_STREAM)
         print(self.host, self.port)
         self.connection.connect((self.host, self.port))
+        # Control frames are small, send them at once (no Nagle)
+        self.connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self._reader = UCFrameReader(self.connection)
         self.sendmsg(struct.pack("IIHH32s32s", self.device.magic[0], self.device.magic[1], 3, self.device.magic[2], self.ident.encode(), self.name.encode()))
 
         print("StudioLive: starting update thread")
         self.update_thread = threading.Thread(target=self.update_process)
         self.update_thread.start()
 
+        self._write_thread = threading.Thread(target=self._write_process)
+        self._write_thread.start()
+
         while not self._connect_event.is_set():
             time.sleep(0.1)
 
-    def update(self, message_header: bytes, message_body: bytes) -> None:
-        unknown1, unknown2, category, unknown3 = struct.unpack("IIHH", message_header)
+    def disconnect(self) -> None:
+        super().disconnect()
+        with self._write_cond:
+            self._write_cond.notify()
+        if self._write_thread:
+            self._write_thread.join()
+            print("StudioLive: UC writes %d, %d coalesced" % (self.writes, self.coalesced))
+
+    def update(self, message_header: bytes | memoryview, message_body: bytes | memoryview) -> None:
+        unknown1, unknown2, category, unknown3 = _header.unpack(message_header)
         assert unknown1 == self.device.magic[0]
         assert unknown2 == self.device.magic[1]
         assert unknown3 == self.device.magic[2]
 
         if category == 5:
             self._connect_event.set()
-            levels = struct.unpack("128B", message_body)
-
-            i = 0
-            for ch in self.channels.values():
-                assert isinstance(ch, UCChannel)
-                if ch.info.stereo:
-                    ch.level = (levels[i], levels[i+1])
-                    i += 2
-                else:
-                    ch.level = levels[i]
-                    i += 1
+            levels = message_body
+            assert len(levels) == 128
+
+            for ch, i, stereo in self._level_offsets:
+                ch.level = (levels[i], levels[i + 1]) if stereo else levels[i]
             super()._update_levels()
 
         elif category == 4:
-            unknown4, channel_id, channel_name = struct.unpack("HH48s", message_body)
+            unknown4, channel_id, channel_name = _channel_name.unpack(message_body)
             channel_name = SLparsestr(channel_name)
 
             assert unknown4 == 0
@@ -112,7 +246,7 @@ class SLUcBackend(SLBackend):
             #    print("StudioLive: recv channel ID %02d name: '%s'" % (channel_id, self.channel_names[channel_id]))
 
         elif category == 2:
-            control_id, value, channel_id = struct.unpack("=Hd32s", message_body)
+            control_id, value, channel_id = _control.unpack(message_body)
             channel_id = SLparsestr(channel_id)
             if channel_id not in self._channel_int:
                 print("StudioLive: recv control update for unknown channel %s" % channel_id)
@@ -152,14 +286,43 @@ class SLUcBackend(SLBackend):
     def update_process(self) -> None:
         assert self.connection
         while not self._stop_event.is_set():
-            message = self.readmsg()
-            self.update(message[:12], message[12:])
+            try:
+                for message in self.readmsgs():
+                    self.update(message[:_header.size], message[_header.size:])
+            except ConnectionError as e:
+                print("StudioLive:", e)
+                break
 
     def set_control(self, ch: SLChannel, control: str, value: SLValue) -> None:
         assert isinstance(ch, UCChannel)
         if ch.name == "geq0":
             print("StudioLive: Upd control of channel %s is not supported" % ch)
             return
-        header = struct.pack("IIHH", self.device.magic[0], self.device.magic[1], 2, self.device.magic[2])
-        body = struct.pack("=Hd32s", ch.info.ctrls[control], value, ch.info.name.encode())
-        self.sendmsg(header + body)
+        header = _header.pack(self.device.magic[0], self.device.magic[1], 2, self.device.magic[2])
+        body = _control.pack(ch.info.ctrls[control], value, ch.info.name.encode())
+        message = header + body
+        key = (ch.info.name, ch.info.ctrls[control])
+        with self._write_cond:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = _frame.pack(UC_SIGNATURE, len(message)) + message
+            held = self._batches.get(threading.get_ident())
+            if held is not None:
+                held.add(key)
+            self._write_cond.notify()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        "Hold the controls set by this thread until the (outermost) batch ends, other threads write as usual"
+        ident = threading.get_ident()
+        with self._write_cond:
+            outer = ident not in self._batches
+            if outer:
+                self._batches[ident] = set()
+        try:
+            yield
+        finally:
+            if outer:
+                with self._write_cond:
+                    del self._batches[ident]
+                    self._write_cond.notify()
@@ -0,0 +1,72 @@
+import random
+import unittest
+
+from osclive import studiolive
+from osclive.studiolive.backend import SLValue
+from osclive.studiolive.raw import RawBaseChannel, RawData, SLBit, SLNibblePair, SLShortInt
+from osclive.studiolive.rawbackend import _get_bit_val, _val_from_nibble_pair
+
+
+def full_decode(info: RawBaseChannel, data: RawData) -> dict[str, SLValue]:
+    "Decode of all controls as the raw backend did before the compiled decoders"
+    values: dict[str, SLValue] = {}
+    for control, pos in info.ctrls.items():
+        b = pos.byte - info.offset
+        if isinstance(pos, SLNibblePair):
+            values[control] = _val_from_nibble_pair(data[b:b + 2], pos.dataType)
+        elif isinstance(pos, SLShortInt):
+            values[control] = data[b]
+        elif isinstance(pos, SLBit):
+            values[control] = _get_bit_val(bytes(data), b, pos.bit)
+    return values
+
+
+class RawDecoderTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.device = studiolive.StudioLive1602.raw
+        self.random = random.Random(1)
+
+    def block(self, info: RawBaseChannel) -> bytearray:
+        # Nibble pairs hold 4 bits per byte
+        return bytearray(self.random.randrange(16) for _ in range(info.length))
+
+    def test_full_decode(self) -> None:
+        for name, info in self.device.channels.items():
+            data = self.block(info)
+            self.assertEqual(dict(info.decoder.decode(data)), full_decode(info, data), name)
+            self.assertEqual(dict(info.decoder.decode(memoryview(data))), full_decode(info, data), name)
+
+    def test_diff_decode(self) -> None:
+        for name, info in self.device.channels.items():
+            old = self.block(info)
+            for _ in range(20):
+                new = bytearray(old)
+                for i in self.random.sample(range(info.length), self.random.randint(1, 4)):
+                    new[i] = self.random.randrange(16)
+
+                changed = info.decoder.diff(old, memoryview(new))
+                assert changed is not None
+                self.assertEqual(changed, [i for i in range(info.length) if old[i] != new[i]])
+
+                # Controls touched by the changed bytes: all controls with a different value, no other
+                before, after = full_decode(info, old), full_decode(info, new)
+                decoded = dict(info.decoder.decode(new, changed))
+                self.assertEqual({c: v for c, v in decoded.items() if v != before[c]},
+                                 {c: v for c, v in after.items() if v != before[c]}, name)
+                for control, value in decoded.items():
+                    self.assertEqual(value, after[control], name)
+                old = new
+
+    def test_diff_unchanged_and_length(self) -> None:
+        info = self.device.channels["ch1"]
+        data = self.block(info)
+        self.assertEqual(info.decoder.diff(data, bytes(data)), [])
+        self.assertIsNone(info.decoder.diff(data, data[:-1]))
+
+    def test_shared_decoder(self) -> None:
+        # Channels of the same layout share one compiled decoder
+        self.assertIs(self.device.channels["ch1"].decoder, self.device.channels["ch2"].decoder)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+import collections
+import threading
+import time
+import unittest
+
+from typing import Any, Callable, Optional
+
+from osclive import studiolive
+from osclive.studiolive.emulator import EmulatorAdapter
+from osclive.studiolive.raw import RawChannel, RawData, SLBit
+from osclive.studiolive.rawbackend import MidiAdapter, SLRawBackend
+
+
+class HookedEmulator(EmulatorAdapter):
+    "Emulator calling a hook after serving a read of the channel"
+    channel = "ch1"
+    hook: Optional[Callable[[], None]] = None
+
+    def write(self, wd: bytes) -> None:
+        super().write(wd)
+        info = self.device.channels[self.channel]
+        if self.hook and bytes(wd) == b"\xf0" + info.read_id + b"\xf7":
+            hook, self.hook = self.hook, None
+            hook()
+
+
+class FailingEmulator(EmulatorAdapter):
+    "Emulator failing the next writes of the channel block"
+    channel = "ch1"
+    failures = 0
+
+    def write(self, wd: bytes) -> None:
+        info = self.device.channels[self.channel]
+        if self.failures and bytes(wd).startswith(b"\xf0" + info.write_id):
+            self.failures -= 1
+            raise Exception("recv_msg - transfer error")
+        super().write(wd)
+
+
+class RefreshRaceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        dev = studiolive.StudioLive1602.raw
+        self.backend = SLRawBackend(dev, write_window=0)
+        self.adapter = HookedEmulator(dev, latency=0)
+        self.backend._adapter = self.adapter
+        self.sl = studiolive.SLRemote(self.backend)
+        self.backend.init_data()
+
+        self.echo: list[float] = []
+        self.sl.add_update_callback(lambda ch, ctrl, value: self.echo.append(value) if (ch, ctrl) == ("ch1", "mute") else None)
+
+    def mute(self, data: RawData) -> bool:
+        info = self.backend.device.channels["ch1"]
+        pos = info.ctrls["mute"]
+        assert isinstance(pos, SLBit)
+        return bool(data[pos.byte - info.offset] & (1 << pos.bit))
+
+    def test_write_during_refresh_read(self) -> None:
+        # Client write lands while the re-read of the channel is in flight
+        self.adapter.hook = lambda: self.sl.set_control("ch1", "mute", 1)
+        self.backend._refresh["ch1"] = None
+        self.backend._refresh_channels(time.monotonic())
+
+        ch = self.backend._allchannels["ch1"]
+        assert isinstance(ch, RawChannel)
+        self.assertEqual(ch.ctrls["mute"], 1)
+        self.assertTrue(self.mute(ch.raw))
+        self.assertEqual(self.echo, [1])
+        # Stale data dropped, the channel is read again later
+        self.assertIn("ch1", self.backend._refresh)
+
+        # Writer flushes the patched block to the mixer
+        self.backend._stop_event.set()
+        self.backend._write_process()
+        self.assertTrue(self.mute(self.adapter.blocks["ch1"]))
+
+        self.backend._refresh_channels(time.monotonic())
+        self.assertEqual(ch.ctrls["mute"], 1)
+        self.assertEqual(self.echo, [1])
+
+    def test_refresh_during_client_echo(self) -> None:
+        # Re-read completes while the client change is being echoed, before the write is sent
+        self.refreshed = False
+
+        def refresh(ch: str, ctrl: str, value: float) -> None:
+            if (ch, ctrl) == ("ch1", "mute") and not self.refreshed:
+                self.refreshed = True
+                self.backend._refresh["ch1"] = None
+                self.backend._refresh_channels(time.monotonic())
+        self.sl.add_update_callback(refresh)
+        # Solo pressed on the console: the mute byte of the block read differs from ch.raw
+        info = self.backend.device.channels["ch1"]
+        pos = info.ctrls["solo"]
+        assert isinstance(pos, SLBit)
+        self.adapter.blocks["ch1"][pos.byte - info.offset] |= 1 << pos.bit
+
+        self.sl.set_control("ch1", "mute", 1)
+        self.assertTrue(self.refreshed)
+        ch = self.backend._allchannels["ch1"]
+        self.assertEqual(ch.ctrls["mute"], 1)
+        self.assertEqual(self.echo, [1])
+        self.assertIn("ch1", self.backend._refresh)
+
+        self.backend._stop_event.set()
+        self.backend._write_process()
+        self.assertTrue(self.mute(self.adapter.blocks["ch1"]))
+        self.backend._refresh_channels(time.monotonic())
+        self.assertEqual(ch.ctrls["mute"], 1)
+        self.assertEqual(self.echo, [1])
+
+    def test_refresh_skipped_while_dirty(self) -> None:
+        self.sl.set_control("ch1", "mute", 1)
+        self.backend._refresh["ch1"] = None
+        self.backend._refresh_channels(time.monotonic())
+        # Not read over the pending write, still queued for a read after it
+        self.assertIn("ch1", self.backend._refresh)
+
+        self.backend._stop_event.set()
+        self.backend._write_process()
+        self.backend._refresh_channels(time.monotonic())
+        self.assertNotIn("ch1", self.backend._refresh)
+
+
+class WriteErrorTest(unittest.TestCase):
+    def test_writes_after_adapter_error(self) -> None:
+        dev = studiolive.StudioLive1602.raw
+        backend = SLRawBackend(dev, write_window=0)
+        adapter = FailingEmulator(dev, latency=0)
+        backend._adapter = adapter
+        sl = studiolive.SLRemote(backend)
+        backend.init_data()
+
+        adapter.failures = 1
+        writer = threading.Thread(target=backend._write_process)
+        writer.start()
+        try:
+            sl.set_control("ch1", "mute", 1)
+            deadline = time.monotonic() + 2
+            while adapter.failures and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.assertEqual(adapter.failures, 0)
+
+            # Writer survives the error and the channel isn't left as being written
+            sl.set_control("ch1", "solo", 1)
+            while not adapter.writes and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.assertTrue(writer.is_alive())
+            self.assertEqual(adapter.writes, 1)
+        finally:
+            backend._stop_event.set()
+            with backend._write_cond:
+                backend._write_cond.notify()
+            writer.join()
+
+        self.assertEqual(backend._writing, set())
+        self.assertEqual(adapter.blocks["ch1"], backend._allchannels["ch1"].raw)
+
+
+class PollRateTest(unittest.TestCase):
+    def test_connected_client_without_meters(self) -> None:
+        dev = studiolive.StudioLive1602.raw
+        backend = SLRawBackend(dev, poll_rate=30, idle_poll_rate=2)
+        sl = studiolive.SLRemote(backend)
+        self.assertEqual(backend._poll_interval(), 1 / 2)
+
+        # Client connected, meters not subscribed
+        sl.add_update_callback(lambda ch, ctrl, value: None)
+        self.assertEqual(backend._poll_interval(), 1 / 30)
+
+
+class BatchTest(unittest.TestCase):
+    def test_batch_holds_own_thread_only(self) -> None:
+        dev = studiolive.StudioLive1602.raw
+        backend = SLRawBackend(dev, write_window=0)
+        adapter = EmulatorAdapter(dev, latency=0)
+        backend._adapter = adapter
+        sl = studiolive.SLRemote(backend)
+        backend.init_data()
+
+        def written(ch: str) -> bool:
+            return adapter.blocks[ch] == backend._allchannels[ch].raw
+
+        def wait(cond: Callable[[], bool]) -> bool:
+            deadline = time.monotonic() + 2
+            while not cond() and time.monotonic() < deadline:
+                time.sleep(0.001)
+            return cond()
+
+        writer = threading.Thread(target=backend._write_process)
+        writer.start()
+        try:
+            with sl.batch():
+                sl.set_control("ch1", "mute", 1)
+                # Another client, outside of the batch
+                other = threading.Thread(target=sl.set_control, args=("ch2", "mute", 1))
+                other.start()
+                other.join()
+                self.assertTrue(wait(lambda: written("ch2")))
+                time.sleep(0.05)
+                self.assertFalse(written("ch1"))
+            self.assertTrue(wait(lambda: written("ch1")))
+        finally:
+            backend._stop_event.set()
+            with backend._write_cond:
+                backend._write_cond.notify()
+            writer.join()
+
+
+class Message():
+    "Message of the MIDI input callback, as mido.Message"
+    def __init__(self, type: str, data: bytes = b"") -> None:
+        self.type = type
+        self.data = data
+
+    def bin(self) -> bytearray:
+        return bytearray(b"\xf0" + self.data + b"\xf7")
+
+
+class MidiQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # Input queue only, without MIDI ports
+        self.adapter = MidiAdapter.__new__(MidiAdapter)
+        self.adapter._in_frames = collections.deque(maxlen=4)
+        self.adapter._in_cond = threading.Condition()
+        self.adapter.dropped = 0
+
+    def receive(self, *data: int) -> None:
+        msg: Any = Message("sysex", bytes(data))
+        self.adapter._input_callback(msg)
+
+    def test_frames_in_order(self) -> None:
+        self.receive(0x10)
+        self.receive(0x6b, 0x01, 0x02)
+        msg: Any = Message("note_on")
+        self.adapter._input_callback(msg)
+        first = self.adapter.read(3)
+        self.assertIsInstance(first, memoryview)
+        self.assertEqual(bytes(first), b"\xf0\x10\xf7")
+        self.assertEqual(bytes(self.adapter.read(5)), b"\xf0\x6b\x01\x02\xf7")
+
+    def test_timeout(self) -> None:
+        with self.assertRaises(SystemError):
+            self.adapter._read(0.01)
+
+    def test_full_queue_drops_oldest(self) -> None:
+        for i in range(6):
+            self.receive(i)
+        self.assertEqual(self.adapter.dropped, 2)
+        self.assertEqual([bytes(self.adapter.read(3))[1] for _ in range(4)], [2, 3, 4, 5])
+
+    def test_reader_woken(self) -> None:
+        timer = threading.Timer(0.05, self.receive, (0x10,))
+        timer.start()
+        start = time.monotonic()
+        self.assertEqual(bytes(self.adapter._read(2)), b"\xf0\x10\xf7")
+        self.assertLess(time.monotonic() - start, 1)
+        timer.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
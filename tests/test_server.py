@@ -0,0 +1,157 @@
+import threading
+import unittest
+
+from typing import Any
+
+from osclive.osc.server import DispatchedOSCRequestHandler, DispatchTable, OutboundQueue, compile_pattern, is_pattern
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def test_order(self) -> None:
+        q = OutboundQueue()
+        for data in [b"a", b"b", b"c"]:
+            q.put(data)
+        self.assertEqual(len(q), 3)
+        self.assertEqual(q.get(), [b"a", b"b", b"c"])
+        self.assertEqual(q.get(block=False), [])
+
+    def test_key_collision(self) -> None:
+        q = OutboundQueue()
+        q.put(b"levels 1", "levels")
+        q.put(b"mute 1", "mute")
+        q.put(b"levels 2", "levels")
+        self.assertIn("levels", q)
+        self.assertEqual(q.coalesced, 1)
+        self.assertEqual(len(q), 2)
+        # Replacement doesn't overtake the packets queued after the replaced one
+        self.assertEqual(q.get(), [b"mute 1", b"levels 2"])
+        self.assertNotIn("levels", q)
+
+    def test_unkeyed_not_coalesced(self) -> None:
+        q = OutboundQueue()
+        q.put(b"a")
+        q.put(b"a")
+        self.assertEqual(q.coalesced, 0)
+        self.assertEqual(q.get(), [b"a", b"a"])
+
+    def test_full_drops_oldest(self) -> None:
+        q = OutboundQueue(maxlen=2)
+        q.put(b"a", "a")
+        q.put(b"b")
+        q.put(b"c")
+        self.assertEqual(q.dropped, 1)
+        self.assertNotIn("a", q)
+        self.assertEqual(q.get(), [b"b", b"c"])
+
+    def test_on_put(self) -> None:
+        q = OutboundQueue()
+        calls: list[int] = []
+        q.on_put = lambda: calls.append(len(q))
+        q.put(b"a", "a")
+        q.put(b"b", "a")
+        # Replacement of a pending packet doesn't wake the writer again
+        self.assertEqual(calls, [1])
+
+    def test_close(self) -> None:
+        q = OutboundQueue()
+        result: list[list[bytes]] = []
+        # Writer blocked on the empty queue is released by close()
+        writer = threading.Thread(target=lambda: result.append(q.get()))
+        writer.start()
+        q.close()
+        writer.join(2)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(result, [[]])
+
+        # Closed queue discards new packets
+        q.put(b"b")
+        self.assertEqual(len(q), 0)
+        self.assertEqual(q.get(), [])
+
+
+class CompilePatternTest(unittest.TestCase):
+    def matches(self, pattern: str, names: list[str]) -> list[str]:
+        regex = compile_pattern(pattern)
+        return [n for n in names if regex.fullmatch(n)]
+
+    def test_wildcards(self) -> None:
+        names = ["ch1", "ch2", "ch10", "aux1", "ch"]
+        self.assertEqual(self.matches("ch*", names), ["ch1", "ch2", "ch10", "ch"])
+        self.assertEqual(self.matches("ch?", names), ["ch1", "ch2"])
+        self.assertEqual(self.matches("*1", names), ["ch1", "aux1"])
+
+    def test_char_ranges(self) -> None:
+        names = ["cha", "chb", "chc", "chd", "ch1"]
+        self.assertEqual(self.matches("ch[a-c]", names), ["cha", "chb", "chc"])
+        self.assertEqual(self.matches("ch[!a-c]", names), ["chd", "ch1"])
+        self.assertEqual(self.matches("ch[]", names), [])
+
+    def test_alternatives(self) -> None:
+        names = ["mute", "solo", "pan", "mutex"]
+        self.assertEqual(self.matches("{mute,solo}", names), ["mute", "solo"])
+
+    def test_literal(self) -> None:
+        # Regex special characters are literals in OSC
+        self.assertEqual(self.matches("a.b", ["a.b", "axb"]), ["a.b"])
+        self.assertFalse(is_pattern("/ch1/mute"))
+        self.assertTrue(is_pattern("/ch*/mute"))
+
+
+class DispatchTableTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.table = DispatchTable()
+        self.calls: list[tuple[Any, ...]] = []
+
+        def callback(handler: Any, address: str, *values: Any) -> None:
+            self.calls.append((address,) + values)
+
+        def callback_args(handler: Any, address: str, args: Any, *values: Any) -> None:
+            self.calls.append((address, args) + values)
+
+        for ch in ["ch1", "ch2", "ch10", "aux1"]:
+            for ctrl in ["mute", "solo"]:
+                self.table.map("/%s/%s" % (ch, ctrl), callback_args, ch, ctrl)
+        self.table.map("/init", callback)
+
+    def test_match(self) -> None:
+        self.assertEqual(self.table.match("/ch1/mute"), ["/ch1/mute"])
+        self.assertEqual(self.table.match("/ch?/mute"), ["/ch1/mute", "/ch2/mute"])
+        self.assertEqual(self.table.match("/ch*/solo"), ["/ch1/solo", "/ch2/solo", "/ch10/solo"])
+        self.assertEqual(self.table.match("/ch[!1]/*"), ["/ch2/mute", "/ch2/solo"])
+        self.assertEqual(self.table.match("/{ch1,aux1}/{mute,solo}"), ["/ch1/mute", "/ch1/solo", "/aux1/mute", "/aux1/solo"])
+
+    def test_no_match(self) -> None:
+        self.assertEqual(self.table.match("/ch3/mute"), [])
+        self.assertEqual(self.table.match("/ch?/pan"), [])
+        self.assertEqual(self.table.match("/ch1"), [])
+        self.assertEqual(self.table.match("/ch1/mute/x"), [])
+
+    def handler(self) -> DispatchedOSCRequestHandler:
+        handler = DispatchedOSCRequestHandler.__new__(DispatchedOSCRequestHandler)
+        handler._dispatcher_maps = {}
+        handler.dispatcher = self.table
+        return handler
+
+    def test_handle_message(self) -> None:
+        handler = self.handler()
+        handler.handle_message("/ch1/mute", [1])
+        handler.handle_message("/init", [])
+        handler.handle_message("/ch{1,2}/solo", [0])
+        handler.handle_message("/unknown", [1])
+        handler.handle_message("/x*", [1])
+        self.assertEqual(self.calls, [
+            ("/ch1/mute", ("ch1", "mute"), 1),
+            ("/init",),
+            ("/ch1/solo", ("ch1", "solo"), 0),
+            ("/ch2/solo", ("ch2", "solo"), 0),
+        ])
+
+    def test_client_map_first(self) -> None:
+        handler = self.handler()
+        handler.map("/ch1/mute", lambda address, *values: self.calls.append(("client", address) + values))
+        handler.handle_message("/ch1/mute", [1])
+        self.assertEqual(self.calls, [("client", "/ch1/mute", 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
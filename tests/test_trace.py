@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from osclive.studiolive.trace import TraceBuffer, TX, RX, CONTROL_OUT, UNHANDLED, NOTE
+from osclive.studiolive.trace import read_trace, decode_control, decode_unhandled
+
+
+class TraceBufferTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "trace.bin")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_round_trip(self) -> None:
+        trace = TraceBuffer(slots=16)
+        trace.frame(TX, b"\xf0\x6b\x01\xf7")
+        trace.frame(RX, memoryview(b"\xf0\x10\xf7"))
+        trace.control(CONTROL_OUT, "ch1", "mute", 1.0)
+        trace.unhandled("ch2", [3, 300])
+        trace.note("reconnect")
+        self.assertEqual(trace.dump(self.path), self.path)
+
+        records = list(read_trace(self.path))
+        self.assertEqual(records, list(trace.records()))
+        self.assertEqual([r[0] for r in records], [1, 2, 3, 4, 5])
+        self.assertEqual([r[2] for r in records], [TX, RX, CONTROL_OUT, UNHANDLED, NOTE])
+        self.assertEqual(records[0][3:], (4, b"\xf0\x6b\x01\xf7"))
+        self.assertEqual(records[1][4], b"\xf0\x10\xf7")
+        self.assertEqual(decode_control(records[2][4]), ("ch1", "mute", 1.0))
+        self.assertEqual(decode_unhandled(records[3][4]), ("ch2", [3, 255]))
+        self.assertEqual(records[4][4], b"reconnect")
+
+    def test_truncation(self) -> None:
+        trace = TraceBuffer(slots=4, slot_size=256)
+        self.assertEqual(trace.payload_size, 234)
+        frame = bytes(i % 256 for i in range(300))
+        trace.frame(RX, frame)
+        trace.frame(TX, frame[:234])
+        trace.dump(self.path)
+
+        (_, _, _, length, payload), (_, _, _, length2, payload2) = read_trace(self.path)
+        # Original length is kept, the payload is cut at the slot size
+        self.assertEqual((length, payload), (300, frame[:234]))
+        self.assertEqual((length2, payload2), (234, frame[:234]))
+
+    def test_ring_keeps_newest(self) -> None:
+        trace = TraceBuffer(slots=4)
+        for i in range(10):
+            trace.note("note %d" % i)
+        self.assertEqual([(seq, payload) for seq, t, kind, length, payload in trace.records()],
+                         [(i + 1, b"note %d" % i) for i in range(6, 10)])
+
+    def test_not_a_trace(self) -> None:
+        with open(self.path, "wb") as f:
+            f.write(b"garbage!")
+        with self.assertRaises(AssertionError):
+            list(read_trace(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
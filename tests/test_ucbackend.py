@@ -0,0 +1,102 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from osclive import studiolive
+from osclive.studiolive.ucbackend import SLUcBackend, UCFrameReader, UC_SIGNATURE
+
+
+def frame(body: bytes) -> bytes:
+    return struct.pack("II", UC_SIGNATURE, len(body)) + body
+
+
+class UCFrameReaderTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sock, self.peer = socket.socketpair()
+        self.sock.settimeout(2)
+
+    def tearDown(self) -> None:
+        self.sock.close()
+        self.peer.close()
+
+    def test_several_frames_per_recv(self) -> None:
+        reader = UCFrameReader(self.sock)
+        self.peer.sendall(frame(b"one") + frame(b"two") + frame(b""))
+        self.assertEqual([bytes(f) for f in reader.frames()], [b"one", b"two", b""])
+
+    def test_partial_frames(self) -> None:
+        reader = UCFrameReader(self.sock)
+        data = frame(b"first") + frame(b"second")
+
+        # Split in the middle of the header of the second frame
+        split = len(frame(b"first")) + 3
+        self.peer.sendall(data[:split])
+        self.assertEqual([bytes(f) for f in reader.frames()], [b"first"])
+        self.peer.sendall(data[split:split + 6])
+        self.assertEqual(list(reader.frames()), [])
+        self.peer.sendall(data[split + 6:])
+        self.assertEqual([bytes(f) for f in reader.frames()], [b"second"])
+
+    def test_buffer_growth(self) -> None:
+        reader = UCFrameReader(self.sock, size=32)
+        small = frame(b"small")
+        body = bytes(range(256)) * 2
+        self.peer.sendall(small + frame(body)[:20])
+        frames = reader.frames()
+        first = next(frames)
+        self.assertEqual(list(frames), [])
+        # The view handed out before the growth stays valid
+        self.assertEqual(bytes(first), b"small")
+
+        rest = frame(body)[20:]
+        received: list[bytes] = []
+        while not received:
+            self.peer.sendall(rest[:64])
+            rest = rest[64:]
+            received = [bytes(f) for f in reader.frames()]
+        self.assertEqual(received, [body])
+        self.assertEqual(rest, b"")
+
+    def test_closed(self) -> None:
+        reader = UCFrameReader(self.sock)
+        self.peer.close()
+        with self.assertRaises(ConnectionError):
+            list(reader.frames())
+
+
+class WriteRateTest(unittest.TestCase):
+    def test_rate_drops_when_idle(self) -> None:
+        # Without the UC connection the frames are dropped by _send, but counted
+        backend = SLUcBackend(studiolive.StudioLive1602.uc, "")
+        backend.rate_window = 0.2
+        sl = studiolive.SLRemote(backend)
+        writer = threading.Thread(target=backend._write_process)
+        writer.start()
+        try:
+            for i in range(4):
+                sl.set_control("ch1", "mute", i % 2)
+                time.sleep(0.005)
+            deadline = time.monotonic() + 2
+            while backend.writes + backend.coalesced < 4 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.assertGreater(backend.write_rate, 0)
+            time.sleep(0.25)
+            self.assertEqual(backend.write_rate, 0)
+
+            # Writes of the last iteration are counted too
+            writes = backend.writes
+            with sl.batch():
+                sl.set_control("ch1", "solo", 1)
+                backend._stop_event.set()
+        finally:
+            backend._stop_event.set()
+            with backend._write_cond:
+                backend._write_cond.notify()
+            writer.join()
+        self.assertEqual(backend.writes, writes + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,431 @@
+#!/usr/bin/python
+"""Hot path benchmarks of the OSC server and the mixer backends
+
+Runs without hardware: the raw backend uses the emulator adapter (not
+connected, no threads), OSC clients are request handlers with a null socket.
+
+Results are printed as JSON (microseconds per operation, best of repeats).
+With --baseline the run is compared to a previous result and exits with
+status 1 when any benchmark is slower than baseline * threshold.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import sys
+import time
+
+from typing import Any, Callable, Iterator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from osclive import studiolive  # noqa: E402
+from osclive.handler import SLClientHandler  # noqa: E402
+from osclive.osc.server import SharedPackets, encode_message  # noqa: E402
+from osclive.studiolive.emulator import EmulatorAdapter  # noqa: E402
+from osclive.studiolive.rawbackend import SLRawBackend  # noqa: E402
+from osclive.studiolive.ucbackend import SLUcBackend  # noqa: E402
+
+
+type Bench = Callable[[], Callable[[], int]]
+
+benchmarks: dict[str, Bench] = {}
+
+
+def bench(name: str) -> Callable[[Bench], Bench]:
+    "Register benchmark: setup function returning the measured function, which returns the number of operations done"
+    def register(fn: Bench) -> Bench:
+        benchmarks[name] = fn
+        return fn
+    return register
+
+
+class NullRequest():
+    "Socket stand-in of a client, counts the sent bytes"
+    def __init__(self) -> None:
+        self.sent = 0
+
+    def sendall(self, data: bytes) -> None:
+        self.sent += len(data)
+
+    def shutdown(self, how: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class NullServer():
+    "Server stand-in, no writer threads: the outbound queues are drained by drain()"
+    protocol = "null"
+
+    def __init__(self) -> None:
+        self.clients: list[Any] = []
+        self.shared = SharedPackets()
+
+    def start_writer(self, handler: Any) -> None:
+        pass
+
+    def drain(self) -> None:
+        for c in self.clients:
+            packets = c.outq.get(block=False)
+            if packets:
+                c.request.sendall(b"".join(packets))
+
+
+def raw_remote() -> tuple[SLRawBackend, studiolive.SLRemote]:
+    dev = studiolive.StudioLive1602.raw
+    be = SLRawBackend(dev)
+    be._adapter = EmulatorAdapter(dev, latency=0)
+    sl = studiolive.SLRemote(be)
+    with contextlib.redirect_stdout(io.StringIO()):
+        be.init_data()
+    return be, sl
+
+
+def clients(sl: studiolive.SLRemote, n: int) -> tuple[NullServer, list[SLClientHandler]]:
+    SLClientHandler.sl = sl
+    server = NullServer()
+    handlers = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(n):
+            handler = SLClientHandler.__new__(SLClientHandler)
+            handler.request = NullRequest()
+            handler.client_address = ("bench", i)
+            handler.server = server  # type: ignore
+            handler.setup()
+            handlers.append(handler)
+    server.drain()
+    return server, handlers
+
+
+def set_levels(be: SLRawBackend, rnd: random.Random) -> None:
+    for ch in be.channels.values():
+        ch.level = rnd.randrange(0, 128)
+
+
+# Benchmarks
+N_CLIENTS = 10
+
+
+@bench("level_fanout")
+def bench_level_fanout() -> Callable[[], int]:
+    "One meter tick: sl_level_handler of all clients, queues drained to null sockets"
+    be, sl = raw_remote()
+    server, handlers = clients(sl, N_CLIENTS)
+    rnd = random.Random(1)
+
+    def run() -> int:
+        for i in range(20):
+            set_levels(be, rnd)
+            be._update_levels()
+            server.drain()
+        return 20
+    return run
+
+
+@bench("level_fanout_blob")
+def bench_level_fanout_blob() -> Callable[[], int]:
+    "One meter tick, blob meter format"
+    be, sl = raw_remote()
+    server, handlers = clients(sl, N_CLIENTS)
+    for h in handlers:
+        h.meters_format("blob")
+    rnd = random.Random(1)
+
+    def run() -> int:
+        for i in range(20):
+            set_levels(be, rnd)
+            be._update_levels()
+            server.drain()
+        return 20
+    return run
+
+
+@bench("init_cached")
+def bench_init_cached() -> Callable[[], int]:
+    "init() of all clients, snapshot already encoded"
+    be, sl = raw_remote()
+    server, handlers = clients(sl, N_CLIENTS)
+
+    def run() -> int:
+        for h in handlers:
+            h.init()
+        server.drain()
+        return len(handlers)
+    return run
+
+
+@bench("init_encode")
+def bench_init_encode() -> Callable[[], int]:
+    "init() after a state change: one snapshot encode shared by all clients"
+    be, sl = raw_remote()
+    server, handlers = clients(sl, N_CLIENTS)
+
+    def run() -> int:
+        be.state_seq += 1
+        for h in handlers:
+            h.init()
+        server.drain()
+        return 1
+    return run
+
+
+@bench("handle_message")
+def bench_handle_message() -> Callable[[], int]:
+    "Exact address dispatch to set_control, echo to the other clients"
+    be, sl = raw_remote()
+    server, handlers = clients(sl, N_CLIENTS)
+    h = handlers[0]
+    addrs = ["/channel/ch%d/mute" % (i + 1) for i in range(12)]
+
+    def run() -> int:
+        for i in range(200):
+            h.handle_message(addrs[i % 12], [i & 1])
+        server.drain()
+        return 200
+    return run
+
+
+@bench("handle_message_pattern")
+def bench_handle_message_pattern() -> Callable[[], int]:
+    "Address pattern matching 12 channels"
+    be, sl = raw_remote()
+    server, handlers = clients(sl, N_CLIENTS)
+    h = handlers[0]
+
+    def run() -> int:
+        for i in range(20):
+            h.handle_message("/channel/ch*/mute", [i & 1])
+        server.drain()
+        return 20
+    return run
+
+
+def raw_update_bench(name: str, info_type: str) -> None:
+    @bench("raw_update_%s" % name)
+    def changed() -> Callable[[], int]:
+        "Decode of a block with a few changed bytes"
+        be, sl = raw_remote()
+        ch = next(ch for ch in be._allchannels.values() if type(ch.info).__name__ == info_type)
+        rnd = random.Random(1)
+        blocks = []
+        for i in range(16):
+            block = bytearray(ch.info.length)
+            for b in rnd.sample(range(ch.info.length), 3):
+                block[b] = rnd.randrange(16)
+            blocks.append(memoryview(bytes(block)))
+
+        def run() -> int:
+            for block in blocks:
+                be._update_channel(ch, block)
+            return len(blocks)
+        return run
+
+    @bench("raw_update_%s_unchanged" % name)
+    def unchanged() -> Callable[[], int]:
+        "Block equal to the previous one"
+        be, sl = raw_remote()
+        ch = next(ch for ch in be._allchannels.values() if type(ch.info).__name__ == info_type)
+        block = memoryview(bytes(ch.raw))
+
+        def run() -> int:
+            for i in range(100):
+                be._update_channel(ch, block)
+            return 100
+        return run
+
+
+for _name, _type in [("input", "RawInputChannel"), ("geq", "RawGeq"), ("fx", "RawFx"), ("masters", "RawMasters"),
+                     ("midicfg", "RawMidiConfig"), ("status", "RawStatus"), ("faders", "RawFaders")]:
+    raw_update_bench(_name, _type)
+
+
+@bench("raw_set_control")
+def bench_raw_set_control() -> Callable[[], int]:
+    "Raw block patch of nibble pair and bit controls, without the write itself"
+    be, sl = raw_remote()
+    ch = be.channels["ch1"]
+
+    def run() -> int:
+        for i in range(100):
+            be.set_control(ch, "gain", i / 100)
+            be.set_control(ch, "mute", i & 1)
+        be._dirty.clear()
+        return 200
+    return run
+
+
+def uc_backend() -> SLUcBackend:
+    be = SLUcBackend(studiolive.StudioLive1602.uc, "")
+    studiolive.SLRemote(be)
+    return be
+
+
+@bench("uc_set_control")
+def bench_uc_set_control() -> Callable[[], int]:
+    "UC frame encode and queue, without the write itself"
+    be = uc_backend()
+    channels = [be.channels["ch%d" % (i + 1)] for i in range(12)]
+
+    def run() -> int:
+        for i in range(120):
+            be.set_control(channels[i % 12], "mute", i & 1)
+        be._pending.clear()
+        return 120
+    return run
+
+
+def uc_message(be: SLUcBackend, category: int, body: bytes) -> tuple[memoryview, memoryview]:
+    magic = be.device.magic
+    message = memoryview(struct.pack("IIHH", magic[0], magic[1], category, magic[2]) + body)
+    return message[:12], message[12:]
+
+
+@bench("uc_update_control")
+def bench_uc_update_control() -> Callable[[], int]:
+    "Category 2 frame: control update"
+    be = uc_backend()
+    ctrl = be.device.channels["ch1"].ctrls["mute"]
+    messages = [uc_message(be, 2, struct.pack("=Hd32s", ctrl, i & 1, b"in%d,0" % (i % 12))) for i in range(24)]
+
+    def run() -> int:
+        for header, body in messages:
+            be.update(header, body)
+        return len(messages)
+    return run
+
+
+@bench("uc_update_levels")
+def bench_uc_update_levels() -> Callable[[], int]:
+    "Category 5 frame: levels"
+    be = uc_backend()
+    rnd = random.Random(1)
+    messages = [uc_message(be, 5, bytes(rnd.randrange(128) for _ in range(128))) for i in range(8)]
+
+    def run() -> int:
+        for header, body in messages:
+            be.update(header, body)
+        return len(messages)
+    return run
+
+
+@bench("encode_message")
+def bench_encode_message() -> Callable[[], int]:
+    def run() -> int:
+        for i in range(100):
+            encode_message("/channel/ch1/gain", i / 100)
+        return 100
+    return run
+
+
+# Runner
+def measure(fn: Callable[[], int], repeat: int, min_time: float) -> list[float]:
+    "Microseconds per operation of each repeat"
+    fn()  # warm up
+    results = []
+    # Like timeit: collections would add noise from the garbage of previous benchmarks
+    gc.collect()
+    gc.disable()
+    try:
+        for r in range(repeat):
+            ops = 0
+            start = time.perf_counter()
+            while True:
+                ops += fn()
+                elapsed = time.perf_counter() - start
+                if elapsed >= min_time:
+                    break
+            results.append(elapsed / ops * 1e6)
+    finally:
+        gc.enable()
+    return results
+
+
+def run(names: list[str], repeat: int, min_time: float) -> Iterator[tuple[str, dict[str, float]]]:
+    for name in names:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn = benchmarks[name]()
+            results = measure(fn, repeat, min_time)
+        yield name, {"us": min(results), "median_us": statistics.median(results)}
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["us"] / baseline[name]["us"]
+        result["baseline_ratio"] = round(ratio, 3)
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    global N_CLIENTS
+
+    argp = argparse.ArgumentParser(description="Benchmarks of the osclive hot paths")
+    argp.add_argument("names", nargs="*", help="Benchmarks to run (default all)")
+    argp.add_argument("-l", "--list", help="List benchmarks", action='store_true')
+    argp.add_argument("-n", "--clients", help="Number of OSC clients (default %d)" % N_CLIENTS, type=int, default=N_CLIENTS)
+    argp.add_argument("-r", "--repeat", help="Repeats of each benchmark, the best one is reported (default 5)", type=int, default=5)
+    argp.add_argument("-t", "--time", help="Minimal time of each repeat (default 0.2 s)", type=float, default=0.2)
+    argp.add_argument("-o", "--output", help="Write results to JSON file")
+    argp.add_argument("-b", "--baseline", help="Compare with results in JSON file")
+    argp.add_argument("--threshold", help="Regression: slower than baseline * threshold (default 1.25)", type=float, default=1.25)
+    args = argp.parse_args()
+
+    if args.list:
+        for name, fn in benchmarks.items():
+            print("%-30s %s" % (name, (fn.__doc__ or "").strip()))
+        return
+
+    N_CLIENTS = args.clients
+
+    names = args.names or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            argp.error("unknown benchmark %s" % name)
+
+    results = {}
+    for name, result in run(names, args.repeat, args.time):
+        results[name] = result
+        print("%-30s %10.2f us" % (name, result["us"]), file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        baseline = json.load(open(args.baseline))["results"]
+        regressions = compare(results, baseline, args.threshold)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "clients": N_CLIENTS,
+        "results": results,
+        "regressions": regressions,
+    }
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+    for name in regressions:
+        print("Regression: %s %.2f us, %.2fx baseline" % (name, results[name]["us"], results[name]["baseline_ratio"]), file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/python
+"""End-to-end control latency: OSC in -> mixer write -> OSC echo to the clients
+
+Runs SharedTCPServer with scripted TCP clients against local stand-ins of the
+mixer: the emulator adapter for the raw backend, a fake Universal Control
+server for the UC backend. Meters are streamed to all clients and some of the
+clients ride faders meanwhile.
+
+One probe at a time toggles a mute from client 0 and is timed at these stages:
+  write      the mixer stand-in receives the new value (raw backend: includes
+             the write coalescing window, --write-window)
+  echo       each client receives the value (all clients, sender included)
+  echo_last  the last client receives the value
+"""
+
+import argparse
+import json
+import math
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from typing import Any, Callable, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pythonosc import osc_packet  # noqa: E402
+
+from osclive import studiolive  # noqa: E402
+from osclive.handler import SLClientHandler  # noqa: E402
+from osclive.osc import SharedTCPServer  # noqa: E402
+from osclive.osc.server import encode_message  # noqa: E402
+from osclive.studiolive.emulator import EmulatorAdapter  # noqa: E402
+from osclive.studiolive.raw import SLBit  # noqa: E402
+from osclive.studiolive.rawbackend import SLRawBackend  # noqa: E402
+from osclive.studiolive.ucbackend import SLUcBackend, UC_SIGNATURE  # noqa: E402
+
+
+PROBE_CHANNELS = ["ch1", "ch2", "ch3", "ch4"]
+
+
+class Probe():
+    def __init__(self, channel: str, value: float, clients: int) -> None:
+        self.channel = channel
+        self.value = value
+        self.address = "/channel/%s/mute" % channel
+        self.clients = clients
+        self.sent = 0.0
+        self.write: Optional[float] = None
+        self.echo: dict[int, float] = {}
+        self.done = threading.Event()
+
+    def written(self, channel: str, value: float) -> None:
+        if self.write is None and channel == self.channel and value == self.value:
+            self.write = time.perf_counter()
+            self._check()
+
+    def echoed(self, client: int) -> None:
+        if client not in self.echo:
+            self.echo[client] = time.perf_counter()
+            self._check()
+
+    def _check(self) -> None:
+        if self.write is not None and len(self.echo) == self.clients:
+            self.done.set()
+
+
+class Tracker():
+    "Current probe, mixer stand-ins and clients report to it"
+    def __init__(self) -> None:
+        self.probe: Optional[Probe] = None
+
+    def written(self, channel: str, value: float) -> None:
+        probe = self.probe
+        if probe:
+            probe.written(channel, value)
+
+
+class Client():
+    "OSC TCP client with the OSC 1.0 length framing, reports probe echoes"
+    def __init__(self, index: int, port: int, tracker: Tracker) -> None:
+        self.index = index
+        self.tracker = tracker
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.received = 0
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+        self.thread.start()
+
+    def send(self, address: str, value: Any) -> None:
+        self.sock.sendall(encode_message(address, value))
+
+    def _reader(self) -> None:
+        buf = b""
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            buf += data
+            while len(buf) >= 4:
+                size = int.from_bytes(buf[:4], byteorder='big')
+                if len(buf) < size + 4:
+                    break
+                packet, buf = buf[4:size + 4], buf[size + 4:]
+                self.received += 1
+                probe = self.tracker.probe
+                if probe and b"/mute" in packet:
+                    for m in osc_packet.OscPacket(packet).messages:
+                        if m.message.address == probe.address and m.message.params[0] == probe.value:
+                            probe.echoed(self.index)
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.thread.join()
+
+
+class TimedEmulator(EmulatorAdapter):
+    "Emulator reporting mute writes of the probe channels"
+    tracker: Tracker
+
+    def _write_block(self, name: str, data: bytes) -> None:
+        super()._write_block(name, data)
+        if name in PROBE_CHANNELS:
+            info = self.device.channels[name]
+            pos = info.ctrls["mute"]
+            assert isinstance(pos, SLBit)
+            self.tracker.written(name, 1.0 if data[pos.byte - info.offset] & (1 << pos.bit) else 0.0)
+
+
+class FakeUCServer():
+    "Universal Control stand-in: streams level frames, reports control writes"
+    def __init__(self, device: type[Any], tracker: Tracker, level_rate: float = 30) -> None:
+        self.device = device
+        self.tracker = tracker
+        self.level_rate = level_rate
+        self.names = {info.name: name for name, info in device.channels.items()}
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self._stop = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _frame(self, category: int, body: bytes) -> bytes:
+        magic = self.device.magic
+        message = struct.pack("IIHH", magic[0], magic[1], category, magic[2]) + body
+        return struct.pack("II", UC_SIGNATURE, len(message)) + message
+
+    def _serve(self) -> None:
+        conn, addr = self.listener.accept()
+        self.conn = conn
+        threading.Thread(target=self._levels, daemon=True).start()
+        buf = b""
+        mute = {info.ctrls["mute"] for info in self.device.channels.values() if "mute" in info.ctrls}
+        while not self._stop.is_set():
+            data = conn.recv(65536)
+            if not data:
+                break
+            buf += data
+            while len(buf) >= 8:
+                signature, size = struct.unpack_from("II", buf)
+                if len(buf) < size + 8:
+                    break
+                message, buf = buf[8:size + 8], buf[size + 8:]
+                category = struct.unpack_from("IIHH", message)[2]
+                if category == 2:
+                    control_id, value, channel = struct.unpack("=Hd32s", message[12:])
+                    name = self.names.get(channel[:channel.find(b"\0")].decode())
+                    if name and control_id in mute:
+                        self.tracker.written(name, value)
+
+    def _levels(self) -> None:
+        i = 0
+        while not self._stop.is_set():
+            i += 1
+            levels = bytes(int(64 + 40 * math.sin(i / 10 + n)) for n in range(128))
+            try:
+                self.conn.sendall(self._frame(5, levels))
+            except OSError:
+                break
+            time.sleep(1 / self.level_rate)
+
+    def close(self) -> None:
+        self._stop.set()
+        self.listener.close()
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def p(q: float) -> float:
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] * 1000
+    return {"p50": round(p(0.5), 3), "p99": round(p(0.99), 3), "max": round(values[-1] * 1000, 3), "n": len(values)}
+
+
+def fader_rider(client: Client, channel: str, rate: float, stop: threading.Event) -> None:
+    t = 0.0
+    while not stop.is_set():
+        client.send("/channel/%s/gain" % channel, 0.5 + 0.4 * math.sin(t))
+        t += 0.1
+        stop.wait(1 / rate)
+
+
+def run_clients(port: int, tracker: Tracker, n: int, writers: int, probes: int, timeout: float) -> dict[str, dict[str, float]]:
+    clients = [Client(i, port, tracker) for i in range(n)]
+    # Let the initial snapshots go out
+    time.sleep(0.5 + n * 0.02)
+
+    stop = threading.Event()
+    riders = []
+    for i in range(min(writers, n)):
+        channel = "ch%d" % (5 + i % 8)
+        t = threading.Thread(target=fader_rider, args=(clients[i], channel, 30, stop), daemon=True)
+        t.start()
+        riders.append(t)
+
+    stages: dict[str, list[float]] = {"write": [], "echo": [], "echo_last": []}
+    lost = 0
+    values = {ch: 0.0 for ch in PROBE_CHANNELS}
+    for i in range(probes):
+        channel = PROBE_CHANNELS[i % len(PROBE_CHANNELS)]
+        values[channel] = 1.0 - values[channel]
+        probe = Probe(channel, values[channel], n)
+        tracker.probe = probe
+        probe.sent = time.perf_counter()
+        clients[0].send(probe.address, probe.value)
+        if not probe.done.wait(timeout):
+            lost += 1
+        tracker.probe = None
+
+        if probe.write is not None:
+            stages["write"].append(probe.write - probe.sent)
+        echoes = [t - probe.sent for t in probe.echo.values()]
+        stages["echo"] += echoes
+        if len(echoes) == n:
+            stages["echo_last"].append(max(echoes))
+        time.sleep(0.01)
+
+    stop.set()
+    for t in riders:
+        t.join()
+    for c in clients:
+        c.close()
+    # Let the server finish the disconnected clients
+    time.sleep(0.2)
+
+    result = {stage: percentiles(values) for stage, values in stages.items()}
+    result["lost"] = {"n": lost}
+    return result
+
+
+def main() -> None:
+    argp = argparse.ArgumentParser(description="End-to-end control latency of osclive")
+    argp.add_argument("-b", "--backend", help="Mixer backend stand-in (default both)", choices=["raw", "uc"], action='append')
+    argp.add_argument("-n", "--clients", help="Client counts (default 1,5,10,20,50)", default="1,5,10,20,50")
+    argp.add_argument("-w", "--writers", help="Clients riding faders meanwhile (default 2)", type=int, default=2)
+    argp.add_argument("-p", "--probes", help="Probes per client count (default 100)", type=int, default=100)
+    argp.add_argument("--latency", help="Emulated raw mixer transaction latency (default 1 ms)", metavar='MS', type=float, default=1)
+    argp.add_argument("--write-window", help="Raw backend write coalescing window (default 20 ms)", metavar='MS', type=float, default=20)
+    argp.add_argument("--port", help="OSC TCP port (default 14301)", type=int, default=14301)
+    argp.add_argument("--timeout", help="Probe timeout (default 1 s)", type=float, default=1)
+    argp.add_argument("-o", "--output", help="Write results to JSON file")
+    args = argp.parse_args()
+
+    counts = [int(n) for n in args.clients.split(",")]
+    report: dict[str, Any] = {"writers": args.writers, "probes": args.probes, "write_window_ms": args.write_window, "results": {}}
+
+    for backend in args.backend or ["raw", "uc"]:
+        tracker = Tracker()
+        uc_server = None
+        slbackend: studiolive.SLBackend
+        if backend == "raw":
+            dev = studiolive.StudioLive1602.raw
+            TimedEmulator.tracker = tracker
+            factory: Callable[[], EmulatorAdapter] = lambda: TimedEmulator(dev, latency=args.latency / 1000)
+            slbackend = SLRawBackend(dev, write_window=args.write_window / 1000, adapter=factory)
+        else:
+            uc_server = FakeUCServer(studiolive.StudioLive1602.uc, tracker)
+            slbackend = SLUcBackend(studiolive.StudioLive1602.uc, "127.0.0.1", uc_server.port)
+
+        sl = studiolive.SLRemote(slbackend)
+        sl.connect()
+        SLClientHandler.sl = sl
+        server = SharedTCPServer(SLClientHandler, port=args.port)
+
+        results = report["results"][backend] = {}
+        for n in counts:
+            result = run_clients(args.port, tracker, n, args.writers, args.probes, args.timeout)
+            results[n] = result
+            print("%-3s %3d clients:" % (backend, n), "  ".join(
+                "%s p50 %.2f p99 %.2f max %.2f ms" % (stage, r["p50"], r["p99"], r["max"])
+                for stage, r in result.items() if r.get("p50") is not None), "lost %d" % result["lost"]["n"], file=sys.stderr)
+
+        server.shutdown()
+        if uc_server:
+            uc_server.close()
+            if isinstance(slbackend, SLUcBackend) and slbackend.connection:
+                slbackend.connection.shutdown(socket.SHUT_RDWR)
+        sl.disconnect()
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
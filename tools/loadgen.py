@@ -0,0 +1,398 @@
+#!/usr/bin/python
+"""OSC TCP load generator: synthetic clients, session recording and replay
+
+  synth   simulate TouchOSC clients: fader rides, page switches (/init and
+          meter (un)subscriptions) and reconnect storms
+  record  proxy real clients to the server and record what they send
+  replay  replay recorded sessions, optionally faster and multiplied
+
+Clients use the OSC 1.0 length framing of ThreadedTCPOSCRequestHandler.
+Reported: messages sent, packets and bytes received per second, and the
+receive lag: time from sending a control value until the client receives
+its echo from the server.
+
+Recording format: 8 byte magic, then records of a ">dHBI" header (time in
+seconds since the start, session number, kind, data length) followed by the
+OSC packet for kind PACKET.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+from typing import Any, BinaryIO, Iterator, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pythonosc import osc_packet  # noqa: E402
+from pythonosc.osc_message_builder import OscMessageBuilder  # noqa: E402
+
+
+MAGIC = b"OSCREC1\n"
+RECORD = struct.Struct(">dHBI")
+CONNECT, PACKET, DISCONNECT = range(3)
+
+
+def write_record(f: BinaryIO, t: float, session: int, kind: int, data: bytes = b"") -> None:
+    f.write(RECORD.pack(t, session, kind, len(data)) + data)
+
+
+def read_records(path: str) -> Iterator[tuple[float, int, int, bytes]]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not an OSC session recording" % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            t, session, kind, size = RECORD.unpack(header)
+            yield t, session, kind, f.read(size)
+
+
+def build_message(address: str, *values: Any) -> bytes:
+    b = OscMessageBuilder(address)
+    for v in values:
+        b.add_arg(v)
+    return b.build().dgram
+
+
+def echo_key(packet: bytes) -> Optional[tuple[str, Any]]:
+    "Control message (address, value) the server echoes back, None for other packets"
+    try:
+        messages = osc_packet.OscPacket(packet).messages
+    except Exception:
+        return None
+    if len(messages) != 1:
+        return None
+    m = messages[0].message
+    if m.address.startswith("/channel/") and len(m.params) == 1 and isinstance(m.params[0], (int, float)):
+        return m.address, float(m.params[0])
+    return None
+
+
+class Stats():
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.sent = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.connects = 0
+        self.errors = 0
+        self.lag: list[float] = []
+        self.lag_lost = 0
+        self.lag_coalesced = 0
+
+    def percentile(self, q: float) -> float:
+        values = sorted(self.lag)
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] * 1000 if values else 0
+
+    def report(self) -> dict[str, Any]:
+        elapsed = time.monotonic() - self.start
+        return {
+            "elapsed": round(elapsed, 3),
+            "connects": self.connects,
+            "errors": self.errors,
+            "sent": self.sent,
+            "sent_per_s": round(self.sent / elapsed, 1),
+            "received": self.received,
+            "received_per_s": round(self.received / elapsed, 1),
+            "received_bytes_per_s": round(self.received_bytes / elapsed, 1),
+            "lag_ms": {
+                "p50": round(self.percentile(0.5), 3),
+                "p99": round(self.percentile(0.99), 3),
+                "max": round(max(self.lag) * 1000, 3) if self.lag else 0,
+                "n": len(self.lag),
+                "lost": self.lag_lost,
+                "coalesced": self.lag_coalesced,
+            },
+        }
+
+
+class LoadClient():
+    "OSC TCP client, counts received packets and matches echoes of the sent control values"
+    def __init__(self, stats: Stats, host: str, port: int) -> None:
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task[None]] = None
+        self.pending: dict[tuple[str, Any], float] = {}
+
+    async def connect(self) -> None:
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.stats.connects += 1
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def close(self) -> None:
+        self.stats.lag_lost += len(self.pending)
+        self.pending = {}
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+        if self._reader_task:
+            await self._reader_task
+            self._reader_task = None
+
+    def send(self, packet: bytes, key: Optional[tuple[str, Any]] = None) -> None:
+        if not self.writer:
+            return
+        self.writer.write(len(packet).to_bytes(4, byteorder='big') + packet)
+        self.stats.sent += 1
+        if key:
+            self.pending[key] = time.monotonic()
+
+    def send_message(self, address: str, *values: Any) -> None:
+        key = (address, float(values[0])) if address.startswith("/channel/") and len(values) == 1 else None
+        self.send(build_message(address, *values), key)
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        stats = self.stats
+        try:
+            while True:
+                size = int.from_bytes(await reader.readexactly(4), byteorder='big')
+                packet = await reader.readexactly(size)
+                stats.received += 1
+                stats.received_bytes += size + 4
+                if self.pending and any(k[0].encode() in packet for k in self.pending):
+                    now = time.monotonic()
+                    for m in osc_packet.OscPacket(packet).messages:
+                        if m.message.params and isinstance(m.message.params[0], (int, float)):
+                            sent = self.pending.pop((m.message.address, float(m.message.params[0])), None)
+                            if sent is not None:
+                                stats.lag.append(now - sent)
+                                # The server echoes just the latest value when the client queue coalesces
+                                older = [k for k, t in self.pending.items() if k[0] == m.message.address and t <= sent]
+                                for k in older:
+                                    del self.pending[k]
+                                stats.lag_coalesced += len(older)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+
+async def progress(stats: Stats, interval: float = 1) -> None:
+    last = (0, 0)
+    while True:
+        await asyncio.sleep(interval)
+        print("sent %6d/s  received %7d/s  lag p50 %.1f ms p99 %.1f ms  connects %d" % (
+            (stats.sent - last[0]) / interval, (stats.received - last[1]) / interval,
+            stats.percentile(0.5), stats.percentile(0.99), stats.connects), file=sys.stderr)
+        last = (stats.sent, stats.received)
+
+
+# Synthetic clients
+async def synth_client(args: argparse.Namespace, stats: Stats, index: int, storm: asyncio.Event, end: float) -> None:
+    rnd = random.Random(index)
+    client = LoadClient(stats, args.host, args.port)
+    rider = index < args.riders
+    channel = "ch%d" % (index % 12 + 1)
+    step = 0
+    page = 0
+    next_page = time.monotonic() + rnd.expovariate(1 / args.page_interval) if args.page_interval else end
+
+    while time.monotonic() < end:
+        try:
+            await client.connect()
+        except OSError:
+            stats.errors += 1
+            await asyncio.sleep(0.5)
+            continue
+
+        storm_seen = storm.is_set()
+        while time.monotonic() < end and storm.is_set() == storm_seen:
+            now = time.monotonic()
+            if rider:
+                # Float values exactly representable in the OSC float32
+                step = (step + 1) % 1024
+                client.send_message("/channel/%s/gain" % channel, abs(512 - step) / 512)
+            if now >= next_page:
+                # Page switch as the TouchOSC pager does it
+                page += 1
+                if page % 2:
+                    client.send_message("/meters/format", "blob")
+                    client.send_message("/meters/subscribe", 20)
+                else:
+                    client.send_message("/meters/unsubscribe")
+                client.send_message("/init")
+                next_page = now + rnd.expovariate(1 / args.page_interval)
+            await asyncio.sleep(1 / args.fader_rate if rider else 0.1)
+
+        await client.close()
+        if storm.is_set() != storm_seen:
+            # Reconnect storm: all clients reconnect at once
+            await asyncio.sleep(rnd.uniform(0, 0.05))
+
+
+async def synth(args: argparse.Namespace, stats: Stats) -> None:
+    end = time.monotonic() + args.duration
+    storm = asyncio.Event()
+    tasks = [asyncio.create_task(synth_client(args, stats, i, storm, end)) for i in range(args.clients)]
+    while time.monotonic() < end:
+        await asyncio.sleep(min(args.storm_interval or args.duration, end - time.monotonic()))
+        if args.storm_interval and time.monotonic() < end:
+            print("Reconnect storm", file=sys.stderr)
+            if storm.is_set():
+                storm.clear()
+            else:
+                storm.set()
+    await asyncio.gather(*tasks)
+
+
+# Recording
+async def record(args: argparse.Namespace, stats: Stats) -> None:
+    f = open(args.output, "wb")
+    f.write(MAGIC)
+    start = time.monotonic()
+    sessions = 0
+
+    async def pipe_to_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while data := await reader.read(65536):
+                stats.received += 1
+                stats.received_bytes += len(data)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def handle(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        nonlocal sessions
+        session = sessions
+        sessions += 1
+        try:
+            server_reader, server_writer = await asyncio.open_connection(args.host, args.port)
+        except OSError:
+            stats.errors += 1
+            client_writer.close()
+            return
+        stats.connects += 1
+        write_record(f, time.monotonic() - start, session, CONNECT)
+        print("Recording session", session, client_writer.get_extra_info('peername'), file=sys.stderr)
+        task = asyncio.create_task(pipe_to_client(server_reader, client_writer))
+        try:
+            while True:
+                size = await client_reader.readexactly(4)
+                packet = await client_reader.readexactly(int.from_bytes(size, byteorder='big'))
+                write_record(f, time.monotonic() - start, session, PACKET, packet)
+                stats.sent += 1
+                server_writer.write(size + packet)
+                await server_writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        write_record(f, time.monotonic() - start, session, DISCONNECT)
+        f.flush()
+        server_writer.close()
+        await task
+
+    server = await asyncio.start_server(handle, "0.0.0.0", args.listen)
+    print("Recording clients connected to port %d into %s" % (args.listen, args.output), file=sys.stderr)
+    try:
+        async with server:
+            if args.duration:
+                await asyncio.sleep(args.duration)
+            else:
+                await server.serve_forever()
+    finally:
+        f.close()
+
+
+# Replay
+async def replay_session(args: argparse.Namespace, stats: Stats, records: list[tuple[float, int, bytes]], start: float) -> None:
+    client = LoadClient(stats, args.host, args.port)
+    connected = False
+    for t, kind, data in records:
+        delay = start + t / args.speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if kind == CONNECT:
+            try:
+                await client.connect()
+                connected = True
+            except OSError:
+                stats.errors += 1
+        elif kind == PACKET and connected:
+            client.send(data, echo_key(data))
+        elif kind == DISCONNECT and connected:
+            # Let the last echoes arrive
+            await asyncio.sleep(0.2)
+            await client.close()
+            connected = False
+    if connected:
+        await asyncio.sleep(0.2)
+        await client.close()
+
+
+async def replay(args: argparse.Namespace, stats: Stats) -> None:
+    sessions: dict[int, list[tuple[float, int, bytes]]] = {}
+    for t, session, kind, data in read_records(args.input):
+        sessions.setdefault(session, []).append((t, kind, data))
+    # Sessions start at the time of the first recorded one
+    t0 = min(records[0][0] for records in sessions.values()) if sessions else 0
+    start = time.monotonic() - t0 / args.speed
+    tasks = [
+        asyncio.create_task(replay_session(args, stats, records, start))
+        for i in range(args.copies) for records in sessions.values()
+    ]
+    await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    argp = argparse.ArgumentParser(description="OSC TCP load generator for osclive")
+    argp.add_argument("--host", help="Server address (default localhost)", default="127.0.0.1")
+    argp.add_argument("--port", help="Server OSC TCP port (default 4301)", type=int, default=4301)
+    argp.add_argument("-o", "--output-stats", help="Write summary to JSON file", metavar="FILE")
+    sub = argp.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("synth", help="Synthetic clients")
+    p.add_argument("-n", "--clients", help="Number of clients (default 20)", type=int, default=20)
+    p.add_argument("-d", "--duration", help="Duration (default 30 s)", type=float, default=30)
+    p.add_argument("--riders", help="Clients riding a fader (default 4)", type=int, default=4)
+    p.add_argument("--fader-rate", help="Fader messages per second of each rider (default 30)", type=float, default=30)
+    p.add_argument("--page-interval", help="Mean time between page switches of each client (default 10 s, 0 = none)", type=float, default=10)
+    p.add_argument("--storm-interval", help="Time between reconnect storms (default 0 = none)", type=float, default=0)
+
+    p = sub.add_parser("record", help="Record sessions of clients connected through this proxy")
+    p.add_argument("output", help="Recording file")
+    p.add_argument("-l", "--listen", help="Proxy port for the clients (default 4311)", type=int, default=4311)
+    p.add_argument("-d", "--duration", help="Stop after (default: until interrupted)", type=float, default=0)
+
+    p = sub.add_parser("replay", help="Replay recorded sessions")
+    p.add_argument("input", help="Recording file")
+    p.add_argument("-s", "--speed", help="Replay speed (default 1)", type=float, default=1)
+    p.add_argument("-c", "--copies", help="Concurrent copies of each session (default 1)", type=int, default=1)
+
+    args = argp.parse_args()
+    stats = Stats()
+
+    async def run() -> None:
+        task = asyncio.create_task(progress(stats))
+        try:
+            await {"synth": synth, "record": record, "replay": replay}[args.command](args, stats)
+        finally:
+            task.cancel()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+    report = stats.report()
+    out = json.dumps(report, indent=2)
+    if args.output_stats:
+        with open(args.output_stats, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
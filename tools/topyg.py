@@ -381,6 +381,33 @@ def createPageMisc(p, frame):
         args=[tosc.Partial(type="VALUE", conversion="STRING", value="text")]
         p.createElement(CT.LABEL, 'label', (0, h-20, 60, 20), md(background=0)).createOSCDP(arguments=args)
 
+    # Decoder of the packed /meters message: blob of uint8 levels of all channels, followed by peaks
+    channels = ", ".join(f'"{ch}"' for ch in CHAN)
+    page.createProperty(pf.build("script", f"""
+local CHANNELS = {{{channels}}}
+
+local function byteAt(blob, i)
+    if type(blob) == "string" then
+        return string.byte(blob, i)
+    end
+    return blob[i]
+end
+
+function onReceiveOSC(msg, connections)
+    if msg[1] ~= "/meters" then
+        return
+    end
+    local blob = msg[2][1].value
+    local n = #CHANNELS
+    for i, name in ipairs(CHANNELS) do
+        local ch = self.children[name]
+        ch.children.level.values.x = math.min(byteAt(blob, i), 15)
+        ch.children.peak.values.x = math.min(byteAt(blob, n + i), 15)
+    end
+    return true
+end"""))
+    page.createOSC(tosc.OSC(path=[tosc.Partial(type="CONSTANT", value="/meters")]))
+
 
 def createPageEqualizer(p, frame):
     p.path = "/channel"
@@ -427,6 +454,28 @@ def main():
         if initfn:
             initfn(page, resizeFrame(pager.getFrame(), h=-40))
 
+    # Meters are visible only on the Misc page, don't let the server send them elsewhere
+    meters_page = [name for name, text, initfn in pages_cfg].index("misc")
+    pager.createProperty(pf.build("script", f"""
+function updateMeters()
+    if self.values.page == {meters_page} then
+        sendOSC('/meters/format', 'blob')
+        sendOSC('/meters/subscribe', 20)
+    else
+        sendOSC('/meters/unsubscribe')
+    end
+end
+
+function init()
+    updateMeters()
+end
+
+function onValueChanged(key)
+    if key == "page" then
+        updateMeters()
+    end
+end"""))
+
     lb = template.createLabeledButton((dim.SW-40, 0, 40, 40), 'connection_ping', "live", md(interactive=0, color=colors.green)).createOSCDP()
 
     tosc.write(root, args.output)
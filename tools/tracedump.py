@@ -0,0 +1,171 @@
+#!/usr/bin/python
+"""Pretty-print a trace dumped by osclive --trace (SIGUSR1 or /trace/dump)
+
+SysEx frames are matched to the StudioLive 16.0.2 channel tables: reads,
+writes and responses are printed with the channel name and the controls
+changed since the previous frame of the same block. Bytes of a block not
+covered by any control are printed as byte offset with old and new value.
+Raw memory dump frames (0x2e) are decoded to RD (hex) and RC (text) lines.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from osclive import studiolive  # noqa: E402
+from osclive.studiolive.raw import RawBaseChannel, RawFaders, RawInputChannel, RawStatus, RawStudioLiveDevice  # noqa: E402
+from osclive.studiolive.rawbackend import decode_raw_dump, h  # noqa: E402
+from osclive.studiolive.trace import TX, RX, CONTROL_IN, CONTROL_OUT, UNHANDLED, NOTE, KIND_NAMES  # noqa: E402
+from osclive.studiolive.trace import read_trace, decode_control, decode_unhandled  # noqa: E402
+
+
+class FrameDecoder():
+    "Matches frames to channel blocks and tracks the last known content of each block"
+    def __init__(self, device: type[RawStudioLiveDevice], levels: bool = False) -> None:
+        self.device = device
+        self.levels = levels
+        self.blocks: dict[str, bytes] = {}
+
+        def by_id(attr: str) -> list[tuple[bytes, str, RawBaseChannel]]:
+            ids = [(getattr(info, attr), name, info) for name, info in device.channels.items() if getattr(info, attr)]
+            # Longest ID first: IDs of some blocks are prefixes of others
+            return sorted(ids, key=lambda i: -len(i[0]))
+        self._reads = by_id("read_id")
+        self._writes = by_id("write_id")
+        self._resps = by_id("resp_id")
+
+        # The fader block holds the gain nibble pairs of the input channels, by channel index
+        self._faders = {info.index: name for name, info in device.channels.items() if isinstance(info, RawInputChannel)}
+
+    @staticmethod
+    def _match(ids: list[tuple[bytes, str, RawBaseChannel]], cmd: bytes) -> Optional[tuple[str, RawBaseChannel]]:
+        for id, name, info in ids:
+            if cmd.startswith(id):
+                return name, info
+        return None
+
+    def channel(self, kind: int, frame: bytes) -> Optional[str]:
+        "Name of the channel block the frame reads or carries"
+        if kind == TX and len(frame) > 2:
+            m = self._match(self._reads, frame[1:-1])
+            if m and len(frame) == len(m[1].read_id) + 2:
+                return m[0]
+            m = self._match(self._writes, frame[1:])
+        else:
+            m = self._match(self._resps, frame[1:])
+        return m[0] if m else None
+
+    def describe(self, kind: int, frame: bytes) -> str:
+        if len(frame) < 3 or frame[0] != 0xf0:
+            return "?  " + h(frame)
+        if frame[1] == 0x2e and frame[2] in [0x40, 0x20]:
+            rawdump = decode_raw_dump(frame)
+            rc = " ".join(chr(n) if chr(n).isascii() and chr(n).isalnum() else "_" for n in rawdump)
+            return "raw dump\n    RD %s\n    RC %s" % ("".join(f"{x:02x}" for x in rawdump), rc)
+        if kind == RX and frame[1:3] == b"\x10\xf7":
+            return "ack"
+
+        name = self.channel(kind, frame)
+        if name is None:
+            return "?  " + h(frame)
+        info = self.device.channels[name]
+        if kind == TX and len(frame) == len(info.read_id) + 2:
+            return "read  %s" % name
+
+        offset = 1 + len(info.write_id) if kind == TX else info.offset
+        block = frame[offset:offset + info.length]
+        if len(block) != info.length:
+            return "%s %s: short block (%d/%d)  %s" % ("write" if kind == TX else "resp ", name, len(block), info.length, h(frame))
+        return "%s %s  %s" % ("write" if kind == TX else "resp ", name, self._changes(name, info, block))
+
+    def _changes(self, name: str, info: RawBaseChannel, block: bytes) -> str:
+        old = self.blocks.get(name)
+        self.blocks[name] = block
+        if old is None:
+            return "(initial)"
+        changed = info.decoder.diff(old, block)
+        if not changed:
+            return "(unchanged)"
+        if isinstance(info, RawFaders):
+            return self._fader_changes(old, block, changed)
+
+        old_values = dict(info.decoder.decode(old, changed))
+        changes = []
+        for control, value in info.decoder.decode(block, changed):
+            if control.startswith("_level_") and not self.levels:
+                continue
+            if value != old_values[control]:
+                changes.append("%s %s -> %s" % (control, _fmt(old_values[control]), _fmt(value)))
+        for i in changed:
+            if not info.decoder.index[i]:
+                changes.append("byte %d: %02x -> %02x" % (i, old[i], block[i]))
+        return ", ".join(changes) if changes else "(levels)"
+
+    def _fader_changes(self, old: bytes, block: bytes, changed: list[int]) -> str:
+        changes = []
+        for index in sorted({i // 2 for i in changed}):
+            b = index * 2
+            name = self._faders.get(index, "#%d" % index)
+            changes.append("%s gain %.3f -> %.3f" % (name, (old[b] << 4 | old[b + 1]) / 255, (block[b] << 4 | block[b + 1]) / 255))
+        return ", ".join(changes)
+
+
+def _fmt(value: float) -> str:
+    return "%.3f" % value if isinstance(value, float) else str(value)
+
+
+def main() -> None:
+    argp = argparse.ArgumentParser(description="Decode osclive trace dump")
+    argp.add_argument("trace", help="Trace file")
+    argp.add_argument("--no-status", help="Hide status polls", action='store_true')
+    argp.add_argument("--levels", help="Show changes of the meter levels", action='store_true')
+    argp.add_argument("-x", "--hex", help="Print frames in hex too", action='store_true')
+    args = argp.parse_args()
+
+    device = studiolive.StudioLive1602.raw
+    decoder = FrameDecoder(device, args.levels)
+    status = [name for name, info in device.channels.items() if isinstance(info, RawStatus)]
+
+    last: Optional[float] = None
+    skip_response = False
+    for seq, t, kind, length, payload in read_trace(args.trace):
+        delta = (t - last) * 1000 if last is not None else 0.0
+        last = t
+        stamp = "%s.%03d %+9.3f ms #%-7d %-5s" % (time.strftime("%H:%M:%S", time.localtime(t)), int(t * 1000) % 1000, delta, seq, KIND_NAMES.get(kind, kind))
+
+        if kind in [TX, RX]:
+            # Status poll: read command followed by the response
+            if args.no_status:
+                if kind == TX:
+                    skip_response = decoder.channel(TX, payload) in status
+                    if skip_response:
+                        continue
+                elif skip_response:
+                    skip_response = False
+                    decoder.describe(kind, payload)
+                    continue
+            text = decoder.describe(kind, payload)
+            if length > len(payload):
+                text += " (truncated %d/%d)" % (len(payload), length)
+            print(stamp, text)
+            if args.hex:
+                print("    " + h(payload))
+        elif kind in [CONTROL_IN, CONTROL_OUT]:
+            channel, control, value = decode_control(payload)
+            print(stamp, "%s %s = %.3f" % (channel, control, value))
+        elif kind == UNHANDLED:
+            channel, changed = decode_unhandled(payload)
+            print(stamp, "%s bytes not decoded: %s" % (channel, " ".join(str(i) for i in changed)))
+        elif kind == NOTE:
+            print(stamp, payload.decode(errors="replace"))
+        else:
+            print(stamp, h(payload))
+
+
+if __name__ == "__main__":
+    main()